@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import struct
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime, timedelta
+
+# rename modes compared by the benchmark, each one runs in its own process so peak RSS is its own
+MODES = {
+    "serial": {"workers": 1, "batchSize": 1, "fastPath": False},
+    "batch": {"workers": 1, "fastPath": False},
+    "pool": {"fastPath": False},
+    "fast-path": {},
+    "cached": {"cache": True},
+}
+
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+
+# share of files taking the capture time of the file before them
+COLLISION_RATE = 0.1
+
+# files whose metadata read and naming are timed one by one
+LATENCY_SAMPLES = 200
+
+
+def _ifd(entries: list, offset: int) -> bytes:
+    # little endian TIFF IFD at offset, values longer than 4 bytes go right after it
+    data = struct.pack("<H", len(entries))
+    extra = b""
+    extraOffset = offset + 2 + 12 * len(entries) + 4
+    for tag, value in entries:
+        if isinstance(value, int):
+            data += struct.pack("<HHII", tag, 4, 1, value)
+        elif len(value) <= 4:
+            data += struct.pack("<HHI", tag, 2, len(value)) + value.ljust(4, b"\0")
+        else:
+            data += struct.pack("<HHII", tag, 2, len(value), extraOffset + len(extra))
+            extra += value
+    return data + b"\0\0\0\0" + extra
+
+
+def _tiff(dt: datetime, model: str, subsec: str = None, offset: str = None) -> bytes:
+    ifd0 = [(0x0110, model.encode() + b"\0"), (0x0131, b"16.0\0"), (0x8769, 0)]
+    exifOffset = 8 + len(_ifd(ifd0, 8))
+    ifd0[-1] = (0x8769, exifOffset)
+
+    exif = [(0x9003, dt.strftime("%Y:%m:%d %H:%M:%S").encode() + b"\0")]
+    if offset is not None:
+        exif.append((0x9011, offset.encode() + b"\0"))
+    if subsec is not None:
+        exif.append((0x9291, subsec.encode() + b"\0"))
+    return b"II" + struct.pack("<HI", 42, 8) + _ifd(ifd0, 8) + _ifd(exif, exifOffset)
+
+
+def makeJpeg(dt: datetime, model: str, subsec: str = None, offset: str = None) -> bytes:
+    app1 = b"Exif\0\0" + _tiff(dt, model, subsec, offset)
+    return b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xda\x00\x02\xff\xd9"
+
+
+def _pngChunk(type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + type + data + struct.pack(">I", zlib.crc32(type + data))
+
+
+def makePng(dt: datetime, model: str) -> bytes:
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + _pngChunk(b"IHDR", header) + _pngChunk(b"eXIf", _tiff(dt, model))
+            + _pngChunk(b"IDAT", zlib.compress(b"\0\0")) + _pngChunk(b"IEND", b""))
+
+
+def _atom(type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, type) + payload
+
+
+def makeMovie(dt: datetime, model: str, brand: bytes, keys: bool, mdatSize: int) -> bytes:
+    seconds = int((dt - QUICKTIME_EPOCH).total_seconds())
+    moov = _atom(b"mvhd", b"\0\0\0\0" + struct.pack(">II", seconds, seconds) + b"\0" * 92)
+    if keys:
+        # Apple style moov/meta with com.apple.quicktime keys
+        names = [b"com.apple.quicktime.model", b"com.apple.quicktime.creationdate"]
+        values = [model.encode(), dt.strftime("%Y-%m-%dT%H:%M:%S+0100").encode()]
+        keysAtom = _atom(b"keys", b"\0\0\0\0" + struct.pack(">I", len(names))
+                         + b"".join(struct.pack(">I4s", len(name) + 8, b"mdta") + name for name in names))
+        ilst = _atom(b"ilst", b"".join(_atom(struct.pack(">I", index + 1), _atom(b"data", struct.pack(">II", 1, 0) + value))
+                                       for index, value in enumerate(values)))
+        moov += _atom(b"meta", _atom(b"hdlr", b"\0" * 24) + keysAtom + ilst)
+    else:
+        moov += _atom(b"udta", _atom(b"\xa9mdl", struct.pack(">HH", len(model), 0) + model.encode()))
+
+    # moov after mdat, like most cameras write it
+    return _atom(b"ftyp", brand + b"\0\0\0\0" + brand) + _atom(b"mdat", b"\0" * mdatSize) + _atom(b"moov", moov)
+
+
+def generateCorpus(directory: Path, count: int, mdatSize: int = 64 * 1024, seed: int = 0):
+    """Writes count synthetic media files, mixing types, camera models and same-second collisions."""
+    generator = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    dt = datetime(2022, 7, 1, 9, 0, 0)
+    kinds = ["iphone-jpg", "generic-jpg", "png", "iphone-mov", "dji-mp4"]
+
+    for index in range(count):
+        if generator.random() >= COLLISION_RATE:
+            dt += timedelta(seconds=generator.randint(1, 120))
+
+        kind = kinds[index % len(kinds)]
+        if kind == "iphone-jpg":
+            name, data = f"IMG_{index:06}.JPG", makeJpeg(dt, "iPhone 12", f"{generator.randint(0, 999):03}", "+01:00")
+        elif kind == "generic-jpg":
+            name, data = f"DSC{index:06}.jpg", makeJpeg(dt, "Generic Camera")
+        elif kind == "png":
+            name, data = f"Screenshot_{index:06}.png", makePng(dt, "Generic Camera")
+        elif kind == "iphone-mov":
+            name, data = f"IMG_{index:06}.MOV", makeMovie(dt, "iPhone 12", b"qt  ", True, mdatSize)
+        else:
+            name, data = f"DJI_{index:06}.MP4", makeMovie(dt, "DJI Pocket", b"isom", False, mdatSize)
+
+        (directory / name).write_bytes(data)
+
+
+def _percentile(values: list, percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def _sample(filenames: list, count: int) -> list:
+    # spread over the corpus so every kind of file is in it
+    step = max(1, len(filenames) // count)
+    return filenames[::step][:count]
+
+
+def runMode(mode: str, corpus: Path, latencySamples: int = LATENCY_SAMPLES) -> dict:
+    """Measures the given mode on the corpus: planning it, the latency of single files, then applying the
+    plan on a copy of the corpus, which stays untouched."""
+    from rename_engine import RenameEngine, RENAME_BATCH_SIZE, FAST_PATH_READERS
+    from media_scanner import DirectoryScanner
+    from renamer import Renamer
+
+    settings = MODES[mode]
+    cache = None
+    if settings.get("cache"):
+        from PySide6.QtCore import QCoreApplication
+        from database import MetadataCacheTable
+        app = QCoreApplication.instance() or QCoreApplication([])
+        cache = MetadataCacheTable()
+
+    engine = RenameEngine(workers=settings.get("workers"), batchSize=settings.get("batchSize", RENAME_BATCH_SIZE),
+                          cache=cache, readers=FAST_PATH_READERS if settings.get("fastPath", True) else {})
+    files = [0]
+
+    def step(filename):
+        files[0] += 1
+
+    try:
+        renamer = Renamer(engine, step=step)
+        if cache:
+            # first pass fills the cache, the second one is measured
+            renamer.plan(corpus)
+            files[0] = 0
+
+        start = time.perf_counter()
+        plan = renamer.plan(corpus)
+        planSeconds = time.perf_counter() - start
+
+        # one file at a time, reading its metadata and naming it, as a file arriving in a watched folder is
+        latencies = []
+        for filename in _sample(list(DirectoryScanner(corpus)), latencySamples):
+            start = time.perf_counter()
+            for _, metadata in engine.metadata([filename]):
+                if metadata is not None:
+                    renamer.nameFor(filename, metadata)
+            latencies.append(time.perf_counter() - start)
+
+        with tempfile.TemporaryDirectory(prefix="mediamanager-apply-") as temporary:
+            copy = Path(temporary) / "corpus"
+            shutil.copytree(corpus, copy)
+            copyPlan = Renamer(engine).plan(copy)
+            start = time.perf_counter()
+            Renamer(engine).apply(copyPlan, Renamer.journal(copy))
+            applySeconds = time.perf_counter() - start
+    finally:
+        engine.terminate()
+
+    return {
+        "mode": mode,
+        "files": files[0],
+        "planned": len(plan),
+        "plan_seconds": planSeconds,
+        "plan_files_per_sec": files[0] / planSeconds if planSeconds else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "renamed": len(copyPlan),
+        "apply_seconds": applySeconds,
+        "apply_files_per_sec": len(copyPlan) / applySeconds if applySeconds else 0.0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def _gitRevision() -> str|None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the rename pipeline on a synthetic media corpus.")
+    parser.add_argument("--files", type=int, default=2000, help="size of the generated corpus")
+    parser.add_argument("--mdat-size", type=int, default=64 * 1024, help="bytes of fake video data per movie")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--corpus", type=Path, help="reuse or keep the corpus in this directory")
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+    parser.add_argument("--run-mode", choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_mode:
+        # child process, one mode only
+        print(json.dumps(runMode(args.run_mode, args.corpus)))
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="mediamanager-bench-") as temporary:
+        corpus = args.corpus or Path(temporary) / "corpus"
+        if not corpus.exists() or not any(corpus.iterdir()):
+            generateCorpus(corpus, args.files, args.mdat_size)
+
+        results = []
+        for mode in args.modes:
+            # run from the temporary directory so the cached mode gets a fresh mediarename.db
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-mode", mode, "--corpus", str(corpus.resolve())],
+                                     capture_output=True, text=True, cwd=temporary,
+                                     env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(Path(__file__).resolve().parent), os.environ.get("PYTHONPATH")]))})
+            if process.returncode:
+                result = {"mode": mode, "error": (process.stderr.strip().splitlines() or ["failed"])[-1]}
+            else:
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    report = {
+        "revision": _gitRevision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "cpu_count": os.cpu_count(),
+        "corpus_files": args.files,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import sys
+import json
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime
+
+from exiftool import ExifToolHelper
+
+from benchmark_rename import generateCorpus, makeJpeg
+from file_type import sniff
+from media_scanner import DirectoryScanner
+from rename_engine import EXIFTOOL_FIELDS, FAST_PATH_READERS
+
+# sub-seconds and offsets exiftool's Composite:SubSecDateTimeOriginal treats specially
+EDGE_CASES = [("", None), ("0", None), ("00", None), ("12a", "+02:00"), ("abc", None), (None, "+01:00"),
+              (None, "0"), ("5", "Z"), ("", "")]
+
+
+def writeEdgeCases(directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+    for index, (subsec, offset) in enumerate(EDGE_CASES):
+        (directory / f"edge_{index:02}.jpg").write_bytes(makeJpeg(datetime(2022, 7, 1, 9, 0, index), "Edge Camera", subsec, offset))
+
+
+def compare(filenames: list, batchSize: int = 200) -> tuple:
+    """Returns [(filename, tag, fast path value, exiftool value)] for every tag the fast path readers get wrong,
+    and how many files they read."""
+    fast = {}
+    for filename in filenames:
+        reader = FAST_PATH_READERS.get(sniff(filename))
+        record = reader(filename) if reader else None
+        if record:
+            fast[record["SourceFile"]] = record
+
+    mismatches = []
+    sources = list(fast)
+    with ExifToolHelper() as helper:
+        for index in range(0, len(sources), batchSize):
+            for record in helper.get_tags(sources[index:index + batchSize], EXIFTOOL_FIELDS):
+                ours = fast[record["SourceFile"]]
+                for tag in sorted(set(EXIFTOOL_FIELDS) & (set(ours) | set(record))):
+                    # exiftool's JSON turns numeric looking strings into numbers
+                    expected = None if record.get(tag) is None else str(record[tag])
+                    if ours.get(tag) != expected:
+                        mismatches.append((record["SourceFile"], tag, ours.get(tag), expected))
+    return mismatches, len(sources)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks the fast path metadata readers against exiftool.")
+    parser.add_argument("paths", type=Path, nargs="*", help="folders or files with real camera samples")
+    parser.add_argument("--files", type=int, default=500, help="size of the generated synthetic corpus, 0 for none")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="mediamanager-check-") as temporary:
+        filenames = []
+        if args.files:
+            generateCorpus(Path(temporary) / "corpus", args.files, mdatSize=1024)
+            writeEdgeCases(Path(temporary) / "edge")
+            filenames += list(DirectoryScanner(Path(temporary), recursive=True))
+        for path in args.paths:
+            filenames += list(DirectoryScanner(path, recursive=True)) if path.is_dir() else [path]
+
+        try:
+            mismatches, checked = compare(filenames)
+        except FileNotFoundError as error:
+            # without exiftool there's nothing to check against, which mustn't pass for a clean run
+            print(f"Can't check the fast path: {error}", file=sys.stderr)
+            return 2
+
+    for filename, tag, ours, expected in mismatches:
+        print(json.dumps({"file": filename, "tag": tag, "fast_path": ours, "exiftool": expected}))
+    print(f"{checked} files read by the fast path, {len(mismatches)} tags differing from exiftool", file=sys.stderr)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,93 @@
+import os
 import time
+import json
+import itertools
+from collections import OrderedDict
+import threading
 from PySide6.QtSql import QSqlDatabase, QSqlQuery, QSqlRecord, QSqlTableModel, QSqlDriver
 
+# every thread opens its own connection to this file
+DATABASE_NAME = "mediarename.db"
+
+# milliseconds a connection waits for another one to finish writing before giving up
+BUSY_TIMEOUT = 5000
+
+# run on every new connection, WAL lets the GUI read while a worker thread writes
+CONNECTION_PRAGMAS = ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"]
+
+# prepared queries kept by every connection, the least recently used one goes first
+QUERY_CACHE_SIZE = 64
+
+# values bound in one IN (...) list, shorter lists are padded so the SQL text, and its prepared query, stays the same
+IN_LIST_SIZE = 100
+
+
+def _inLists(values: list, size: int = IN_LIST_SIZE):
+    # (placeholders, params) for every chunk of values, padded with NULLs, which IN never matches
+    placeholders = ",".join("?" * size)
+    for index in range(0, len(values), size):
+        chunk = list(values[index:index + size])
+        yield placeholders, chunk + [None] * (size - len(chunk))
+
+
+class _Connection:
+    # a thread's own connection, removed at the latest when the thread's locals go away
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._queries = OrderedDict()
+        self.database = QSqlDatabase.addDatabase("QSQLITE", name)
+        self.database.setDatabaseName(DATABASE_NAME)
+        self.database.setConnectOptions(f"QSQLITE_BUSY_TIMEOUT={BUSY_TIMEOUT}")
+        if self.database.open():
+            for pragma in CONNECTION_PRAGMAS:
+                QSqlQuery(pragma, self.database)
+
+    def query(self, sql: str) -> QSqlQuery:
+        query = self._queries.get(sql)
+        if query is not None:
+            self._queries.move_to_end(sql)
+            return query
+
+        query = QSqlQuery(self.database)
+        query.setForwardOnly(True)
+        if not query.prepare(sql):
+            raise Exception(f"Database Error: {query.lastError().text()}\n{sql}")
+        self._queries[sql] = query
+        if len(self._queries) > QUERY_CACHE_SIZE:
+            self._queries.popitem(last=False)
+        return query
+
+    def close(self):
+        if self.database is None:
+            return
+        # queries still around would keep the connection from being removed
+        self._queries.clear()
+        self.database.close()
+        self.database = None
+        QSqlDatabase.removeDatabase(self.name)
+
+    def __del__(self):
+        self.close()
+
+
 class DatabaseManager:
+    """Hands every thread its own connection, Qt SQL connections can't be shared between threads."""
+
     __instance = None
+    __lock = threading.Lock()
     @staticmethod
     def get():
         if not DatabaseManager.__instance:
-            DatabaseManager.__instance = DatabaseManager()
+            with DatabaseManager.__lock:
+                if not DatabaseManager.__instance:
+                    DatabaseManager.__instance = DatabaseManager()
         return DatabaseManager.__instance
 
     def __init__(self) -> None:
-        self.database = QSqlDatabase.addDatabase("QSQLITE")
-        self.database.setDatabaseName("mediarename.db")
-        self.database.open()
+        self._local = threading.local()
+        # thread idents are reused, the serial keeps the names of connections not removed yet apart
+        self._serial = itertools.count()
+        database = self.database
 
         QSqlQuery("""
             CREATE TABLE IF NOT EXITS "hashtags2" (
@@ -25,7 +100,7 @@ class DatabaseManager:
                 "last_data_update"	TEXT,
                 "last_trend_update"	TEXT,
                 PRIMARY KEY("id" AUTOINCREMENT)
-            )""")
+            )""", database)
 
         QSqlQuery("""
             CREATE TABLE IF NOT EXITS "collections" (
@@ -33,7 +108,7 @@ class DatabaseManager:
                 "name"	TEXT NOT NULL,
                 "referrals"	TEXT,
                 PRIMARY KEY("id" AUTOINCREMENT)
-            )""")
+            )""", database)
 
         QSqlQuery("""
             CREATE TABLE IF NOT EXITS "users" (
@@ -41,7 +116,7 @@ class DatabaseManager:
                 "name"	TEXT NOT NULL,
                 "daily_likes"	INTEGER,
                 PRIMARY KEY("id" AUTOINCREMENT)
-            )""")
+            )""", database)
 
         QSqlQuery("""
             CREATE TABLE "hashtags" (
@@ -54,7 +129,7 @@ class DatabaseManager:
             	"suggestions"	TEXT,
             	"last_update"	INTEGER DEFAULT 0,
                 PRIMARY KEY("id","name")
-            )""")
+            )""", database)
 
         QSqlQuery("""
             CREATE TABLE "collection_hashtags" (
@@ -63,38 +138,116 @@ class DatabaseManager:
                 "hashtag"	TEXT NOT NULL,
             	"favorite"	INTEGER DEFAULT 0,
                 PRIMARY KEY("id" AUTOINCREMENT)
-            )""")
+            )""", database)
 
+        QSqlQuery("""
+            CREATE TABLE IF NOT EXISTS "metadata_cache" (
+                "device"	INTEGER NOT NULL,
+                "inode"	INTEGER NOT NULL,
+                "size"	INTEGER NOT NULL,
+                "mtime"	INTEGER NOT NULL,
+                "metadata"	TEXT NOT NULL,
+                "last_used"	INTEGER NOT NULL,
+                PRIMARY KEY("device","inode")
+            )""", database)
+
+        QSqlQuery("""CREATE INDEX IF NOT EXISTS "metadata_cache_last_used" ON "metadata_cache" ("last_used")""", database)
 
-class DatabaseExecution:
-    def __init__(self, sql, params=[]) -> None:
-        self._sql = sql
-        self._query = QSqlQuery(DatabaseManager.get().database)
-        self._query.prepare(sql)
-        self._params = params
+        QSqlQuery("""
+            CREATE TABLE IF NOT EXISTS "media" (
+                "id"	INTEGER,
+                "path"	TEXT NOT NULL UNIQUE,
+                "captured"	TEXT,
+                "model"	TEXT,
+                "file_type"	TEXT,
+                "size"	INTEGER,
+                "sample_hash"	TEXT,
+                "phash"	TEXT,
+                "burst"	INTEGER,
+                "last_update"	INTEGER DEFAULT 0,
+                PRIMARY KEY("id" AUTOINCREMENT)
+            )""", database)
 
-        has_placeholders = self._query.driver().hasFeature(QSqlDriver.NamedPlaceholders)
+        QSqlQuery("""CREATE INDEX IF NOT EXISTS "media_captured" ON "media" ("captured")""", database)
+        QSqlQuery("""CREATE INDEX IF NOT EXISTS "media_model_captured" ON "media" ("model", "captured")""", database)
+        QSqlQuery("""CREATE INDEX IF NOT EXISTS "media_burst" ON "media" ("burst")""", database)
 
-        for param in params:
-            self._query.addBindValue(param)
+        QSqlQuery("""
+            CREATE TABLE IF NOT EXISTS "directory_fingerprints" (
+                "path"	TEXT NOT NULL,
+                "parent"	TEXT,
+                "mtime_ns"	INTEGER NOT NULL,
+                PRIMARY KEY("path")
+            )""", database)
 
-        print(self._sql)
-        # print(self._query.boundValues())
+    @property
+    def _connection(self) -> _Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = _Connection(f"mediamanager-{threading.get_ident()}-{next(self._serial)}")
+            self._local.connection = connection
+        return connection
 
-        if not self._query.exec():
-            raise Exception(f"Database Error: {self._query.lastError().text()}\n{self._sql}\n{self._params}")
+    @property
+    def database(self) -> QSqlDatabase:
+        """The calling thread's connection, opened on its first use."""
+        return self._connection.database
+
+    def release(self):
+        """Closes the calling thread's connection, for worker threads to call before they end."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            del self._local.connection
+            connection.close()
+
+    def query(self, sql: str) -> QSqlQuery:
+        """A query with sql prepared on the calling thread's connection, the same one every time for the same text."""
+        return self._connection.query(sql)
+
+
+class DatabaseExecution:
+    """Runs sql on the calling thread's connection, reusing the query prepared for the same text.
+
+    The rows are read as it runs, so the prepared query is free again for the next execution.
+    """
+
+    # called as tracer(sql, params, seconds, rows) after every execution when set, see query_profiler.QueryProfiler
+    tracer = None
+
+    def __init__(self, sql, params=[]) -> None:
+        self._sql = sql
+        self._params = params
+        tracer = DatabaseExecution.tracer
+        if tracer is not None:
+            start = time.perf_counter()
+        query = DatabaseManager.get().query(sql)
+
+        for index, param in enumerate(params):
+            query.bindValue(index, param)
+
+        if not query.exec():
+            error = query.lastError().text()
+            query.finish()
+            raise Exception(f"Database Error: {error}\n{self._sql}\n{self._params}")
+
+        self._items = []
+        select = query.isSelect()
+        if select:
+            record = query.record()
+            columns = range(record.count())
+            names = [record.fieldName(index) for index in columns]
+            while query.next():
+                self._items.append({names[index]: None if query.isNull(index) else query.value(index) for index in columns})
+        self._rows_affected = query.numRowsAffected()
+        self._last_insert_id = query.lastInsertId()
+        query.finish()
+
+        if tracer is not None:
+            tracer(sql, params, time.perf_counter() - start, len(self._items) if select else self._rows_affected)
 
     @property
     def items(self) -> list:
-        result = []
-
-        while self._query.next():
-            record = self._query.record()
-            new_record = {}
-            for index in range(0, record.count()):
-                new_record[record.fieldName(index)] = None if record.isNull(index) else record.value(index)
-            result.append(new_record)
-        return result
+        return self._items
 
     @property
     def first(self) -> dict|None:
@@ -103,11 +256,11 @@ class DatabaseExecution:
 
     @property
     def rows_affected(self) -> int:
-        return self._query.numRowsAffected()
+        return self._rows_affected
 
     @property
     def last_insert_id(self) -> int:
-        return self._query.lastInsertId()
+        return self._last_insert_id
 
 class DatabaseTableBase:
     def __init__(self) -> None:
@@ -132,19 +285,22 @@ class DatabaseTableBase:
             return ""
         result = ""
         for col in order:
-            result = f"{result} {'AND' if result else 'ORDER BY'} {col}"
+            result = f"{result}{',' if result else 'ORDER BY'} {col}"
         return result
 
     def select(self, table: str, cols: str='*', where: dict=None, order: list=None, limit:int=None) -> DatabaseExecution:
         params = []
         where_params = []
-        limit_str = f"LIMIT {limit}" if limit else ""
+        # the limit is bound like the values so the text, and the query prepared for it, stays the same
+        limit_str = "LIMIT ?" if limit else ""
         where_str, where_params = self.__process_where(where)
         order_str = self.__process_order(order)
 
         sql = f"SELECT {cols} FROM `{table}` {where_str} {order_str} {limit_str}"
 
         params += where_params
+        if limit:
+            params.append(limit)
 
         return DatabaseExecution(sql, params)
 
@@ -187,7 +343,7 @@ class Table:
         self._table_object = DatabaseTableBase()
 
     def exists(self, where:str=None):
-        return self.select(where=where).first is not None
+        return self.select(where=where, limit=1).first is not None
 
     def select(self, cols: str='*', where: str=None, order: str=None, limit=None) -> DatabaseExecution:
         return self._table_object.select(self._table_name, cols, where, order, limit)
@@ -201,6 +357,21 @@ class Table:
     def delete(self, where:str=None) -> DatabaseExecution:
         return self._table_object.delete(self._table_name, where)
 
+    def selectIn(self, column: str, values: list, cols: str='*', where: str=None, params: list=[], limit: int=None) -> list:
+        """Rows whose column is one of values, where (bound to params) being an extra condition."""
+        condition = f" AND {where}" if where else ""
+        items = []
+        for placeholders, chunk in _inLists(list(values)):
+            if limit is None:
+                items += DatabaseExecution(f"SELECT {cols} FROM `{self._table_name}` WHERE {column} IN ({placeholders}){condition}",
+                                           chunk + params).items
+                continue
+            items += DatabaseExecution(f"SELECT {cols} FROM `{self._table_name}` WHERE {column} IN ({placeholders}){condition} LIMIT ?",
+                                       chunk + params + [limit - len(items)]).items
+            if len(items) >= limit:
+                break
+        return items
+
 
 class HashtagTable(Table):
     def __init__(self) -> None:
@@ -211,12 +382,10 @@ class HashtagTable(Table):
         return self.select(where={"id": id}).first
 
     def suggestions(self, name):
-        if isinstance(name, list):
-            name = [f"'{n}'" for n in name]
-        else:
-            name = [f"'{name}'"]
+        if not isinstance(name, list):
+            name = [name]
 
-        suggestions = self.select(cols="suggestions", where=f"name in ({','.join(name)})").items
+        suggestions = self.selectIn("name", name, cols="suggestions")
 
         result = []
         for suggestion in suggestions:
@@ -244,9 +413,7 @@ class CollectionHashtagsTable(Table):
         if isinstance(collections, str):
             collections = collections.split(",")
 
-        collections = [f"'{collection}'" for collection in collections]
-
-        return [record["hashtag"] for record in self.select(where=f"collection in ({','.join(collections)})").items]
+        return [record["hashtag"] for record in self.selectIn("collection", collections)]
 
 class CollectionsTable(Table):
     _cache = None
@@ -267,9 +434,8 @@ class CollectionsTable(Table):
 
     def hashtags(self, collections: str|list):
         records = CollectionHashtagsTable().hashtags(collections)
-        quoted_hashtags = [f"'{record}'" for record in records]
 
-        return HashtagTable().select(where=f"name in ({','.join(quoted_hashtags)})").items
+        return HashtagTable().selectIn("name", records)
 
         # result = []
         # for hashtag in hashtags:
@@ -289,13 +455,14 @@ class CollectionsTable(Table):
         if not collections:
             collections = self.collections()
 
-        collectionHashtags += self.collectionHashtags(collections)
+        collectionHashtags += CollectionHashtagsTable().hashtags(collections)
 
         suggestions = HashtagTable().suggestions(collectionHashtags)
 
         # collectionHashtags = [f"'{hashtag}'" for hashtag in collectionHashtags]
 
-        records = HashtagTable().select(where=f"name in ({','.join(collectionHashtags)}) AND last_update < 9999999999 and last_update < {time.time() - (60*60*24*30)}", limit=limit).items
+        records = HashtagTable().selectIn("name", collectionHashtags, where="last_update < 9999999999 AND last_update < ?",
+                                          params=[int(time.time() - (60*60*24*30))], limit=limit)
         return [record["name"] for record in records]
 
 
@@ -314,3 +481,175 @@ class UserTable(Table):
     @property
     def likes(self) -> int:
         return UserTable._users[self._user]["daily_likes"]
+
+
+class MetadataCacheTable(Table):
+    # entries not used for this long are dropped, in seconds
+    MAX_AGE = 60*60*24*180
+    MAX_ENTRIES = 500000
+
+    def __init__(self) -> None:
+        super().__init__("metadata_cache")
+
+    def lookup(self, stats: dict) -> dict:
+        """Takes {key: os.stat_result} and returns {key: metadata} for the entries still matching the file."""
+        result = {}
+        if not stats:
+            return result
+
+        # one device at a time, so the lookups go through the (device, inode) key
+        devices = {}
+        for stat in stats.values():
+            devices.setdefault(stat.st_dev, []).append(stat.st_ino)
+        records = {}
+        for device, inodes in devices.items():
+            for record in self.selectIn("inode", inodes, where="device=?", params=[device]):
+                records[(record["device"], record["inode"])] = record
+
+        hits = {}
+        for key, stat in stats.items():
+            record = records.get((stat.st_dev, stat.st_ino))
+            if record and record["size"] == stat.st_size and record["mtime"] == stat.st_mtime_ns:
+                result[key] = json.loads(record["metadata"])
+                hits.setdefault(stat.st_dev, []).append(stat.st_ino)
+
+        now = int(time.time())
+        for device, inodes in hits.items():
+            for placeholders, params in _inLists(inodes):
+                DatabaseExecution(f"UPDATE `{self._table_name}` SET last_used=? WHERE device=? AND inode IN ({placeholders})",
+                                  [now, device] + params)
+
+        return result
+
+    def store(self, entries: list):
+        """Takes a list of (os.stat_result, metadata) and caches them."""
+        now = int(time.time())
+        database = DatabaseManager.get().database
+        database.transaction()
+        for stat, metadata in entries:
+            metadata = {key: value for key, value in metadata.items() if key != "SourceFile"}
+            DatabaseExecution(f"INSERT OR REPLACE INTO `{self._table_name}` (device,inode,size,mtime,metadata,last_used) VALUES (?,?,?,?,?,?)",
+                              [stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, json.dumps(metadata), now])
+        database.commit()
+
+    def evict(self, maxAge: int = MAX_AGE, maxEntries: int = MAX_ENTRIES):
+        DatabaseExecution(f"DELETE FROM `{self._table_name}` WHERE last_used < ?", [int(time.time()) - maxAge])
+        DatabaseExecution(f"DELETE FROM `{self._table_name}` WHERE rowid IN "
+                          f"(SELECT rowid FROM `{self._table_name}` ORDER BY last_used DESC LIMIT -1 OFFSET ?)", [maxEntries])
+
+
+class MediaTable(Table):
+    """Catalog of every file the renamer has seen, filled as a side effect of renaming."""
+
+    # format of the captured column, sorts like the dates it holds
+    DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self) -> None:
+        super().__init__("media")
+
+    def _date(self, value) -> str:
+        return value if isinstance(value, str) else value.strftime(MediaTable.DATE_FORMAT)
+
+    def hashes(self, paths: list) -> dict:
+        """Returns {absolute path: (size, sample_hash)} for the given paths already in the catalog."""
+        result = {}
+        for record in self.selectIn("path", [os.path.abspath(path) for path in paths], cols="path, size, sample_hash"):
+            result[record["path"]] = (record["size"], record["sample_hash"])
+        return result
+
+    def store(self, records: list, removed: list = []):
+        """Inserts or refreshes records (dicts keyed by column) and drops the rows of removed paths."""
+        now = int(time.time())
+        database = DatabaseManager.get().database
+        database.transaction()
+        for path in removed:
+            self.delete(where={"path": os.path.abspath(path)})
+        for record in records:
+            DatabaseExecution(f"INSERT INTO `{self._table_name}` (path,captured,model,file_type,size,sample_hash,last_update) VALUES (?,?,?,?,?,?,?) "
+                              "ON CONFLICT(path) DO UPDATE SET captured=excluded.captured, model=excluded.model, file_type=excluded.file_type, "
+                              "size=excluded.size, sample_hash=excluded.sample_hash, last_update=excluded.last_update",
+                              [os.path.abspath(record["path"]), record["captured"], record["model"], record["file_type"],
+                               record["size"], record["sample_hash"], now])
+        database.commit()
+
+    def between(self, start, end, model: str = None) -> list:
+        """Files captured in [start, end], optionally from one camera model only."""
+        where = "captured BETWEEN ? AND ?"
+        params = [self._date(start), self._date(end)]
+        if model:
+            where = f"model=? AND {where}"
+            params.insert(0, model)
+        return DatabaseExecution(f"SELECT * FROM `{self._table_name}` WHERE {where} ORDER BY captured", params).items
+
+    def byModel(self, model: str) -> list:
+        return DatabaseExecution(f"SELECT * FROM `{self._table_name}` WHERE model=? ORDER BY captured", [model]).items
+
+    def _under(self, directory: str) -> list:
+        # paths below directory, as a range on the path index
+        directory = os.path.join(os.path.abspath(directory), "")
+        return [record["path"] for record in DatabaseExecution(f"SELECT path FROM `{self._table_name}` WHERE path >= ? AND path < ?",
+                                                                [directory, directory[:-1] + chr(ord(os.sep) + 1)]).items]
+
+    def prune(self, directories: list, existing: set, trees: list = []):
+        """Drops the rows of files directly in directories that aren't in existing (absolute paths) and of
+        every file under trees, returns how many were dropped."""
+        paths = []
+        for directory in directories:
+            directory = os.path.abspath(directory)
+            paths += [path for path in self._under(directory) if os.path.dirname(path) == directory and path not in existing]
+        for tree in trees:
+            paths += self._under(tree)
+
+        database = DatabaseManager.get().database
+        database.transaction()
+        for path in paths:
+            self.delete(where={"path": path})
+        database.commit()
+        return len(paths)
+
+    def storeBursts(self, hashes: dict, groups: list):
+        """Records the perceptual hash of every path in hashes, and for every group of near identical
+        pictures marks its members with the id of the first one."""
+        database = DatabaseManager.get().database
+        database.transaction()
+        for path, value in hashes.items():
+            DatabaseExecution(f"UPDATE `{self._table_name}` SET phash=?, burst=NULL WHERE path=?",
+                              [f"{value:016x}", os.path.abspath(path)])
+        for group in groups:
+            paths = [os.path.abspath(path) for path in group]
+            for placeholders, params in _inLists(paths):
+                DatabaseExecution(f"UPDATE `{self._table_name}` SET burst=(SELECT id FROM `{self._table_name}` WHERE path=?) "
+                                  f"WHERE path IN ({placeholders})", [paths[0]] + params)
+        database.commit()
+
+    def bursts(self) -> list:
+        """Groups of near identical pictures, each one in capture order."""
+        groups = {}
+        for record in DatabaseExecution(f"SELECT * FROM `{self._table_name}` WHERE burst IS NOT NULL ORDER BY burst, captured, path").items:
+            groups.setdefault(record["burst"], []).append(record)
+        return list(groups.values())
+
+
+class DirectoryFingerprintTable(Table):
+    """mtime of every directory an incremental scan listed, see media_scanner.IncrementalScanner."""
+
+    def __init__(self) -> None:
+        super().__init__("directory_fingerprints")
+
+    def subtree(self, root) -> dict:
+        """Returns {path: (parent, mtime_ns)} for root and every directory below it."""
+        root = os.path.abspath(root)
+        below = os.path.join(root, "")
+        records = DatabaseExecution(f"SELECT * FROM `{self._table_name}` WHERE path = ? OR (path >= ? AND path < ?)",
+                                    [root, below, below[:-1] + chr(ord(os.sep) + 1)]).items
+        return {record["path"]: (record["parent"], record["mtime_ns"]) for record in records}
+
+    def store(self, fingerprints: dict, removed: list = []):
+        database = DatabaseManager.get().database
+        database.transaction()
+        for path in removed:
+            self.delete(where={"path": path})
+        for path, (parent, mtime) in fingerprints.items():
+            DatabaseExecution(f"INSERT OR REPLACE INTO `{self._table_name}` (path,parent,mtime_ns) VALUES (?,?,?)",
+                              [path, parent, mtime])
+        database.commit()
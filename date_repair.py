@@ -0,0 +1,74 @@
+import os
+import re
+from datetime import datetime, timedelta
+
+# a file between two neighbours shot at most this far apart is taken to be from the same moment
+NEIGHBOUR_GAP = timedelta(minutes=30)
+
+# dates in names like IMG_20220701_090000, PXL_20220701_090000123, Screenshot_2022-07-01-09-00-00
+# or WhatsApp Image 2022-07-01 at 09.00.00
+NAME_DATE = re.compile(r"(?<!\d)((?:19|20)\d\d)[-_.]?(\d\d)[-_.]?(\d\d)(?:[-_ T.]| at )?(\d\d)[-_.:]?(\d\d)[-_.:]?(\d\d)", re.ASCII)
+
+# tag written for a file type, anything else gets EXIF:DateTimeOriginal
+QUICKTIME_TYPES = {"mov", "mp4", "m4v", "3gp"}
+
+
+def dateFromName(name: str) -> datetime|None:
+    match = NAME_DATE.search(name)
+    if not match:
+        return None
+    try:
+        return datetime(*map(int, match.groups()))
+    except ValueError:
+        return None
+
+
+def _nameDate(name: str) -> datetime:
+    # names given by the renamer start with %Y%m%d_%H%M%S
+    return datetime(int(name[0:4]), int(name[4:6]), int(name[6:8]), int(name[9:11]), int(name[11:13]), int(name[13:15]))
+
+
+def inferDates(undated: list, named: list) -> dict:
+    """Guesses when the undated files were shot, returns {filename: (datetime, how)}.
+
+    named is [(filename, new name)] for the files of the same run that have a date. The date comes
+    from the file's name when it has one, else from the files around it (by name) in its folder
+    when both were shot within NEIGHBOUR_GAP of each other, else from its modification time.
+    """
+    folders = {}
+    for filename, newName in named:
+        folders.setdefault(filename.parent, []).append((filename.name, _nameDate(newName)))
+    for filename in undated:
+        folders.setdefault(filename.parent, []).append((filename.name, None))
+
+    result = {}
+    for folder, files in folders.items():
+        files.sort()
+        # closest dated file after every position, the one before is tracked while walking
+        after = [None] * len(files)
+        for index in range(len(files) - 2, -1, -1):
+            after[index] = files[index + 1][1] or after[index + 1]
+
+        before = None
+        for index, (name, date) in enumerate(files):
+            if date is not None:
+                before = date
+                continue
+
+            filename = folder / name
+            date = dateFromName(name)
+            if date:
+                result[filename] = (date, "name")
+            elif before and after[index] and abs(after[index] - before) <= NEIGHBOUR_GAP:
+                result[filename] = (min(before, after[index]), "neighbours")
+            else:
+                try:
+                    result[filename] = (datetime.fromtimestamp(os.stat(filename).st_mtime).replace(microsecond=0), "mtime")
+                except OSError:
+                    continue
+    return result
+
+
+def dateTag(filename, metadata: dict) -> str:
+    kind = str(metadata.get("File:FileTypeExtension") or filename.suffix[1:]).lower()
+    return "QuickTime:CreateDate" if kind in QUICKTIME_TYPES else "EXIF:DateTimeOriginal"
@@ -0,0 +1,79 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from media_hash import sampleHash, SAMPLE_SIZE
+from media_scanner import TO_DELETE_PREFIX
+from rename_plan import PlanEntry, RenameJournal
+
+# chunk size used when hashing whole files
+READ_SIZE = 1024 * 1024
+
+
+def fullHash(filename) -> str:
+    digest = hashlib.blake2b(digest_size=32)
+    with open(filename, "rb") as file:
+        # hashlib releases the GIL on large updates, so several files hash in parallel
+        while chunk := file.read(READ_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _refine(groups: list, hashFunction, executor: ThreadPoolExecutor) -> list:
+    # splits every group by hashFunction, keeping only the buckets that still hold more than one file
+    filenames = [filename for group in groups for filename in group]
+    result = []
+    hashes = dict(zip(filenames, executor.map(hashFunction, filenames)))
+    for group in groups:
+        buckets = {}
+        for filename in group:
+            buckets.setdefault(hashes[filename], []).append(filename)
+        result += [bucket for bucket in buckets.values() if len(bucket) > 1]
+    return result
+
+
+def findDuplicates(filenames, workers: int = None) -> list:
+    """Groups files with identical content, the file to keep comes first in every group.
+
+    Files are bucketed by size first, then by a hash of their first and last 64 KB and only the
+    files still colliding after that are read in full.
+    """
+    sizes = {}
+    fileSizes = {}
+    for filename in filenames:
+        try:
+            size = fileSizes[filename] = os.stat(filename).st_size
+        except OSError:
+            continue
+        if size:
+            sizes.setdefault(size, []).append(filename)
+
+    groups = [group for group in sizes.values() if len(group) > 1]
+    if not groups:
+        return []
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dedup") as executor:
+        groups = _refine(groups, lambda filename: sampleHash(filename, fileSizes[filename]), executor)
+
+        # the sample already covers small files entirely
+        small = [group for group in groups if fileSizes[group[0]] <= 2 * SAMPLE_SIZE]
+        large = [group for group in groups if fileSizes[group[0]] > 2 * SAMPLE_SIZE]
+        groups = small + _refine(large, fullHash, executor)
+
+    return [sorted(group, key=lambda filename: os.path.basename(filename)) for group in groups]
+
+
+def markDuplicates(groups: list, journal: RenameJournal) -> list:
+    """Renames every file but the first of each group to __to_delete__<name>, returns the warnings raised."""
+    entries = [PlanEntry(filename, f"{TO_DELETE_PREFIX}{filename.name}") for group in groups for filename in group[1:]]
+    if not entries:
+        return []
+
+    warnings = []
+    journal.begin(entries)
+    for entry in entries:
+        warning = RenameJournal.rename(entry.source, entry.target)
+        if warning:
+            warnings.append(warning)
+    journal.end()
+    return warnings
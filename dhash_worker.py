@@ -0,0 +1,27 @@
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QImage, QImageReader
+
+# the hash compares HASH_SIZE x HASH_SIZE neighbouring pixels, 64 bits
+HASH_SIZE = 8
+
+
+def dHash(filename) -> int|None:
+    """Difference hash of a picture, or None when it can't be decoded.
+
+    The picture is decoded straight to (HASH_SIZE + 1) x HASH_SIZE grey pixels, which lets the JPEG
+    decoder skip most of the work, and every bit tells whether a pixel is darker than its right
+    neighbour. Kept apart from everything else, this module is all the hashing processes import.
+    """
+    reader = QImageReader(str(filename))
+    reader.setScaledSize(QSize(HASH_SIZE + 1, HASH_SIZE))
+    image = reader.read()
+    if image.isNull():
+        return None
+
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    value = 0
+    for y in range(HASH_SIZE):
+        row = [image.pixel(x, y) & 0xff for x in range(HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            value = value << 1 | (row[x] < row[x + 1])
+    return value
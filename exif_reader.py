@@ -0,0 +1,132 @@
+import mmap
+import re
+import struct
+
+# tags read from IFD0
+TAG_MODEL = 0x0110
+TAG_SOFTWARE = 0x0131
+TAG_EXIF_IFD = 0x8769
+
+# tags read from the Exif IFD
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_SUBSEC_TIME_ORIGINAL = 0x9291
+
+TYPE_ASCII = 2
+TYPE_LONG = 4
+
+OFFSET_FORMAT = re.compile(r"^[-+]\d{2}:\d{2}$")
+SUBSEC_DIGITS = re.compile(r"^\d+", re.ASCII)
+
+
+def _perlTrue(value: str|None) -> bool:
+    # exiftool's composite conditions are Perl truth tests, "" and "0" are false
+    return value is not None and value not in ("", "0")
+
+
+def _readIfd(data, start: int, offset: int, endian: str, wanted: set) -> dict:
+    result = {}
+    count = struct.unpack_from(f"{endian}H", data, start + offset)[0]
+    for index in range(count):
+        entry = start + offset + 2 + index * 12
+        tag, type, components = struct.unpack_from(f"{endian}HHI", data, entry)
+        if tag not in wanted:
+            continue
+
+        if type == TYPE_LONG:
+            result[tag] = struct.unpack_from(f"{endian}I", data, entry + 8)[0]
+        elif type == TYPE_ASCII:
+            if components <= 4:
+                value = data[entry + 8:entry + 8 + components]
+            else:
+                valueOffset = struct.unpack_from(f"{endian}I", data, entry + 8)[0]
+                value = data[start + valueOffset:start + valueOffset + components]
+            # exiftool stops strings at the first null and trims trailing blanks
+            result[tag] = value.split(b"\0")[0].decode("utf-8", "replace").rstrip()
+    return result
+
+
+def _findExif(data) -> int:
+    # walks the JPEG markers up to the start of the image data, returns where the TIFF header starts
+    if data[:2] != b"\xff\xd8":
+        return -1
+
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return -1
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # fill byte
+            position += 1
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            return -1
+
+        length = struct.unpack_from(">H", data, position + 2)[0]
+        if marker == 0xE1 and data[position + 4:position + 10] == b"Exif\0\0":
+            return position + 10
+        position += 2 + length
+    return -1
+
+
+def readJpegMetadata(filename) -> dict|None:
+    """Reads the tags generate_filename uses straight from the JPEG APP1 segment, named as exiftool -G -n would.
+
+    Returns None when the file isn't a JPEG or lacks EXIF:DateTimeOriginal, so the caller can ask exiftool instead.
+    """
+    try:
+        with open(filename, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start = _findExif(data)
+                if start < 0:
+                    return None
+
+                byteOrder = data[start:start + 2]
+                if byteOrder == b"II":
+                    endian = "<"
+                elif byteOrder == b"MM":
+                    endian = ">"
+                else:
+                    return None
+
+                magic, ifd0 = struct.unpack_from(f"{endian}HI", data, start + 2)
+                if magic != 42:
+                    return None
+
+                tags = _readIfd(data, start, ifd0, endian, {TAG_MODEL, TAG_SOFTWARE, TAG_EXIF_IFD})
+                if TAG_EXIF_IFD not in tags:
+                    return None
+                tags.update(_readIfd(data, start, tags[TAG_EXIF_IFD], endian,
+                                     {TAG_DATETIME_ORIGINAL, TAG_OFFSET_TIME_ORIGINAL, TAG_SUBSEC_TIME_ORIGINAL}))
+    except (OSError, ValueError, IndexError, struct.error):
+        # empty files can't be mapped, truncated ones run off the end
+        return None
+
+    if not tags.get(TAG_DATETIME_ORIGINAL):
+        return None
+
+    result = {
+        "SourceFile": str(filename),
+        "File:FileTypeExtension": "jpg",
+        "EXIF:DateTimeOriginal": tags[TAG_DATETIME_ORIGINAL],
+    }
+    if TAG_MODEL in tags:
+        result["EXIF:Model"] = tags[TAG_MODEL]
+    if TAG_SOFTWARE in tags:
+        result["EXIF:Software"] = tags[TAG_SOFTWARE]
+
+    # same rules as exiftool's Composite:SubSecDateTimeOriginal, which needs a true sub-second or
+    # offset value and only keeps the leading digits of the sub-seconds
+    subsec = tags.get(TAG_SUBSEC_TIME_ORIGINAL)
+    offset = tags.get(TAG_OFFSET_TIME_ORIGINAL)
+    if _perlTrue(subsec) or _perlTrue(offset):
+        composite = result["EXIF:DateTimeOriginal"]
+        digits = SUBSEC_DIGITS.match(subsec) if _perlTrue(subsec) else None
+        if digits:
+            composite = f"{composite}.{digits.group()}"
+        if _perlTrue(offset) and OFFSET_FORMAT.match(offset):
+            composite = f"{composite}{offset}"
+        result["Composite:SubSecDateTimeOriginal"] = composite
+
+    return result
@@ -0,0 +1,51 @@
+# bytes read from the start of a file to tell its type
+HEADER_SIZE = 32
+
+# ftyp brands of the ISO base media formats that aren't plain mp4
+FTYP_BRANDS = {
+    b"qt  ": "mov",
+    b"heic": "heic",
+    b"heix": "heic",
+    b"hevc": "heic",
+    b"mif1": "heic",
+    b"msf1": "heic",
+    b"crx ": "cr3",
+    b"3gp4": "3gp",
+    b"3gp5": "3gp",
+    b"3g2a": "3gp",
+}
+
+# atoms old QuickTime movies start with, when they have no ftyp
+QUICKTIME_ATOMS = {b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+
+def sniffHeader(header: bytes) -> str|None:
+    """Returns the real type of a file from its first HEADER_SIZE bytes, None when it isn't a picture or a movie."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(header[8:12], "mp4")
+    if header[4:8] in QUICKTIME_ATOMS:
+        return "mov"
+    if header.startswith(b"\x00\x00\x01\xba") or header.startswith(b"\x00\x00\x01\xb3"):
+        return "mpg"
+    if header.startswith(b"II*\x00") or header.startswith(b"MM\x00*"):
+        return "tiff"
+    if header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
+        return "gif"
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        return "webp"
+    if header.startswith(b"RIFF") and header[8:12] == b"AVI ":
+        return "avi"
+    # anything else, sidecars (.AAE plists), text, or uploads not written yet (empty or zero filled)
+    return None
+
+
+def sniff(filename) -> str|None:
+    try:
+        with open(filename, "rb") as file:
+            return sniffHeader(file.read(HEADER_SIZE))
+    except OSError:
+        return None
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+from pathlib import Path
+from threading import Thread, Lock
+
+from media_scanner import MEDIA_EXTENSIONS, TO_DELETE_PREFIX
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# a file is handed over once its size and mtime stayed the same for this long, in seconds
+SETTLE_TIME = 3.0
+
+# how often the directory is listed when inotify isn't available, in seconds
+POLL_INTERVAL = 10.0
+
+
+class _Inotify:
+    def __init__(self, directory: Path) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def names(self) -> list:
+        result = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return result
+
+        position = 0
+        while position + EVENT_HEADER.size <= len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            name = data[position:position + length].split(b"\0")[0]
+            position += length
+            if name:
+                result.append(os.fsdecode(name))
+        return result
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher(Thread):
+    """Hands new media files arriving in a directory to a callback, once they stopped growing.
+
+    Uses inotify on Linux and sleeps in select() between events, falling back to listing the
+    directory every POLL_INTERVAL seconds elsewhere. Files already there when watching starts are
+    left to a normal rename, and so are the names the renamer itself gives, see ignore().
+    """
+
+    def __init__(self, directory: Path, callback, settleTime: float = SETTLE_TIME, pollInterval: float = POLL_INTERVAL) -> None:
+        super().__init__(name="Folder Watcher", daemon=True)
+        self._directory = Path(directory)
+        self._callback = callback
+        self._settleTime = settleTime
+        self._pollInterval = pollInterval
+        self._extensions = set(MEDIA_EXTENSIONS)
+        self._pending = {}
+        # names about to be given by a rename in the directory, not to be taken for new files
+        self._produced = set()
+        self._producedLock = Lock()
+        self._wakeRead, self._wakeWrite = os.pipe()
+        self._stopped = False
+
+        self._inotify = None
+        if sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify(self._directory)
+            except OSError:
+                self._inotify = None
+        self._known = None if self._inotify else set(os.listdir(self._directory))
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def polling(self) -> bool:
+        return self._inotify is None
+
+    def stop(self):
+        self._stopped = True
+        os.write(self._wakeWrite, b"\0")
+
+    def ignore(self, target: Path):
+        """Skips the next arrival of target, called from the rename worker before it renames a file to it."""
+        target = Path(target)
+        if target.parent == self._directory:
+            with self._producedLock:
+                self._produced.add(target.name)
+
+    def _isMedia(self, name: str) -> bool:
+        if name.startswith(TO_DELETE_PREFIX) or "." not in name:
+            return False
+        return name.rpartition(".")[2].lower() in self._extensions
+
+    def _arrived(self, names: list):
+        now = time.monotonic()
+        with self._producedLock:
+            produced = self._produced.intersection(names)
+            self._produced -= produced
+        for name in names:
+            if name not in produced and self._isMedia(name):
+                # any change restarts the settle time
+                self._pending[name] = (None, now)
+
+    def _poll(self):
+        names = set(os.listdir(self._directory))
+        self._arrived(names - self._known)
+        self._known = names
+
+    def _settled(self) -> list:
+        now = time.monotonic()
+        ready = []
+        for name, (signature, changed) in list(self._pending.items()):
+            try:
+                stat = os.stat(self._directory / name)
+            except OSError:
+                # renamed away or deleted before it settled
+                del self._pending[name]
+                continue
+
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[name] = (current, now)
+            elif now - changed >= self._settleTime:
+                del self._pending[name]
+                ready.append(self._directory / name)
+        return ready
+
+    def _timeout(self):
+        if self._pending:
+            return self._settleTime / 2
+        # nothing to wait for, sleep until the next event
+        return self._pollInterval if self.polling else None
+
+    def run(self):
+        descriptors = [self._wakeRead] + ([self._inotify.fd] if self._inotify else [])
+        try:
+            while not self._stopped:
+                readable, _, _ = select.select(descriptors, [], [], self._timeout())
+                if self._stopped:
+                    break
+
+                if self._inotify and self._inotify.fd in readable:
+                    self._arrived(self._inotify.names())
+                elif self.polling:
+                    self._poll()
+
+                ready = self._settled()
+                if ready:
+                    self._callback(sorted(ready))
+        finally:
+            if self._inotify:
+                self._inotify.close()
+            os.close(self._wakeRead)
+            os.close(self._wakeWrite)
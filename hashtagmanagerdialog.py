@@ -303,9 +303,7 @@ class HashtagManagerDialog(QDialog):
 
         self._suggestedHashtags.clear()
 
-        quoted_suggestions = ','.join(f"'{suggestion}'" for suggestion in suggestions)
-
-        records = self._hashtags_table.select(where=f"name in ({quoted_suggestions})").items
+        records = self._hashtags_table.selectIn("name", suggestions)
         mapped_records = {}
         for record in records:
             mapped_records[record["name"]] = record
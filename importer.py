@@ -0,0 +1,197 @@
+import os
+import mmap
+import errno
+import fcntl
+import hashlib
+import logging
+from pathlib import Path
+
+from rename_engine import RenameEngine
+from rename_plan import RenamePlan, RenameJournal
+from media_scanner import DirectoryScanner
+from media_hash import sampleHash
+from renamer import Renamer, SCAN_CHUNK_SIZE
+
+# ioctl sharing the extents of a file with another one (btrfs, xfs, ...), _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# bytes copied by the kernel between two updates of the hash
+COPY_CHUNK = 64 * 1024 * 1024
+
+# errors telling a copy method isn't available for this pair of files
+UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EBADF, errno.EPERM}
+
+
+def _hash(view, digest):
+    for offset in range(0, len(view), COPY_CHUNK):
+        digest.update(view[offset:offset + COPY_CHUNK])
+    return digest
+
+
+def _copyChunks(copy, view, digest, size: int):
+    # copy(offset, count) moves bytes in the kernel, the hash reads the same pages from the source mapping
+    offset = 0
+    while offset < size:
+        copied = copy(offset, min(COPY_CHUNK, size - offset))
+        if not copied:
+            raise OSError(errno.EIO, "file shrank while being copied")
+        if digest:
+            digest.update(view[offset:offset + copied])
+        offset += copied
+
+
+def copyFile(source: Path, target: Path, verify: bool = True) -> str:
+    """Copies source to target, which must not exist, without moving the data through Python.
+
+    Tries a reflink first, then copy_file_range and sendfile. With verify, a reflink, which shares the
+    source's extents, only gets its size and sample hash checked. A real copy has the source hashed from
+    its mapping while it is copied, then the target synced, dropped from the page cache and hashed
+    back from disk. A mismatch removes the target and raises OSError. Returns the method used.
+    """
+    stat = os.stat(source)
+    size = stat.st_size
+    digest = hashlib.blake2b(digest_size=32) if verify else None
+    method = None
+
+    with open(source, "rb") as sourceFile, open(target, "xb") as targetFile:
+        try:
+            sourceFd, targetFd = sourceFile.fileno(), targetFile.fileno()
+            with mmap.mmap(sourceFd, 0, access=mmap.ACCESS_READ) if size else memoryview(b"") as mapping, \
+                    memoryview(mapping) as view:
+                try:
+                    fcntl.ioctl(targetFd, FICLONE, sourceFd)
+                    method = "reflink"
+                except OSError as error:
+                    if error.errno not in UNSUPPORTED:
+                        raise
+
+                if method is None:
+                    try:
+                        _copyChunks(lambda offset, count: os.copy_file_range(sourceFd, targetFd, count, offset, offset),
+                                    view, digest, size)
+                        method = "copy_file_range"
+                    except OSError as error:
+                        # only a method refused on the first chunk can be swapped for another one
+                        if error.errno not in UNSUPPORTED or os.fstat(targetFd).st_size:
+                            raise
+                        digest = hashlib.blake2b(digest_size=32) if verify else None
+
+                if method is None:
+                    _copyChunks(lambda offset, count: os.sendfile(targetFd, sourceFd, offset, count), view, digest, size)
+                    method = "sendfile"
+
+            os.fsync(targetFd)
+            if verify and method != "reflink" and hasattr(os, "posix_fadvise"):
+                # the hash below has to read what reached the disk, not the pages just written
+                os.posix_fadvise(targetFd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except BaseException:
+            os.remove(target)
+            raise
+
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    if verify and method == "reflink":
+        if os.stat(target).st_size != size or sampleHash(source, size) != sampleHash(target, size):
+            os.remove(target)
+            raise OSError(errno.EIO, f"{target} doesn't match {source} after cloning")
+    elif verify and size:
+        with open(target, "rb") as targetFile, mmap.mmap(targetFile.fileno(), 0, access=mmap.ACCESS_READ) as mapping, \
+                memoryview(mapping) as view:
+            copied = _hash(view, hashlib.blake2b(digest_size=32))
+        if copied.digest() != digest.digest():
+            os.remove(target)
+            raise OSError(errno.EIO, f"{target} doesn't match {source} after copying")
+    return method
+
+
+class Importer:
+    """Copies the media of a card or staging folder into library/YYYY/MM, under the name the renamer gives them.
+
+    Files already imported (same name and content in their library folder) are skipped, so an
+    import can simply be run again after it was interrupted. Imports are logged in the library's
+    rename journal and can be undone from there while the originals are still around.
+    """
+
+    def __init__(self, engine: RenameEngine, renamer: Renamer, library: Path, verify: bool = True,
+                 message=None, step=None) -> None:
+        self._engine = engine
+        self._renamer = renamer
+        self._library = Path(library)
+        self._verify = verify
+        self._message = message or (lambda text, level=logging.INFO: None)
+        self._step = step or (lambda filename: None)
+
+    @property
+    def journal(self) -> RenameJournal:
+        return RenameJournal(self._library)
+
+    def _imported(self, plan: RenamePlan, source: Path, directory: Path, name: str, extension: str) -> bool:
+        names = plan.existing(directory, name, extension)
+        if not names:
+            return False
+        size = os.stat(source).st_size
+        candidates = [directory / filename for filename in names if (directory / filename).exists()]
+        candidates = [candidate for candidate in candidates if os.stat(candidate).st_size == size]
+        return bool(candidates) and sampleHash(source, size) in {sampleHash(candidate, size) for candidate in candidates}
+
+    def plan(self, source: Path) -> RenamePlan:
+        """Works out where every media file under source goes in the library."""
+        plan = RenamePlan()
+        chunk = []
+        scanner = DirectoryScanner(source, recursive=True)
+        for filename in scanner:
+            chunk.append(filename)
+            if len(chunk) >= SCAN_CHUNK_SIZE:
+                self._planChunk(plan, chunk)
+                chunk = []
+        self._planChunk(plan, chunk)
+        self._engine.evictCache()
+        return plan
+
+    def _planChunk(self, plan: RenamePlan, chunk: list):
+        for filename, metadata in self._engine.metadata(chunk):
+            self._step(filename.name)
+            if metadata is None:
+                self._message(f"{filename} has no metadata, not importing it", logging.WARNING)
+                continue
+
+            rule, new_filename = self._renamer.nameFor(filename, metadata)
+            if new_filename is None:
+                self._message(f"Not importing {filename}")
+                continue
+
+            extension = filename.suffix[1:].lower()
+            directory = self._library / new_filename[0:4] / new_filename[4:6]
+            if self._imported(plan, filename, directory, new_filename, extension):
+                continue
+
+            entry = plan.add(filename, new_filename, extension, rule.name, directory)
+            for warning in entry.warnings:
+                self._message(warning, logging.WARNING)
+            plan.named.append((filename, new_filename, metadata))
+
+    def apply(self, plan: RenamePlan, cancelled=None) -> dict:
+        """Copies every planned file, returns how many files each copy method handled."""
+        journal = self.journal
+        journal.begin(list(plan), copy=True)
+
+        methods = {}
+        copied = set()
+        for entry in plan:
+            if cancelled and cancelled():
+                self._message("Import cancelled, import again to copy the rest.", logging.WARNING)
+                break
+
+            try:
+                os.makedirs(entry.directory, exist_ok=True)
+                method = copyFile(entry.source, entry.target, self._verify)
+            except OSError as error:
+                self._message(f"Couldn't import {entry.source}: {error}", logging.ERROR)
+                continue
+            methods[method] = methods.get(method, 0) + 1
+            copied.add(entry.source)
+        journal.end()
+
+        if self._renamer.catalog:
+            self._renamer.updateCatalog(plan, [named for named in plan.named if named[0] in copied])
+        return methods
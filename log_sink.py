@@ -0,0 +1,91 @@
+import sys
+import time
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from PySide6.QtCore import QObject, QTimer, Slot
+
+# lines kept in memory and in the view
+LOG_CAPACITY = 5000
+
+# how often pending lines are appended to the view, in milliseconds
+FLUSH_INTERVAL = 100
+
+# size and number of the rotated log files
+LOG_FILE_SIZE = 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+class LogSink(QObject):
+    """Fixed capacity log shown in a QPlainTextEdit, costing the same per line however long the session runs.
+
+    Lines go to a ring buffer and are appended to the view in one go every FLUSH_INTERVAL, the view
+    itself dropping its oldest blocks past the capacity. With a fileName, every line also goes to a
+    rotating log file.
+    """
+
+    def __init__(self, view: "QPlainTextEdit", capacity: int = LOG_CAPACITY, fileName: str = None,
+                 echo: bool = False, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self._view = view
+        self._view.setMaximumBlockCount(capacity)
+        self._lines = deque(maxlen=capacity)
+        self._pending = deque(maxlen=capacity)
+        self._level = logging.INFO
+        self._echo = echo
+
+        self._logger = None
+        if fileName:
+            self._logger = logging.getLogger("mediamanager")
+            self._logger.setLevel(logging.DEBUG)
+            self._logger.propagate = False
+        if self._logger and not self._logger.handlers:
+            handler = RotatingFileHandler(fileName, maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            self._logger.addHandler(handler)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(FLUSH_INTERVAL)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def setLevel(self, level: int):
+        """Lines below level are kept in the buffer and the file but not shown."""
+        self._level = level
+
+    def write(self, text: str, level: int = logging.INFO):
+        line = (time.time(), level, text)
+        self._lines.append(line)
+        if level >= self._level:
+            self._pending.append(line)
+        if self._logger:
+            self._logger.log(level, text)
+        if self._echo:
+            print(text, file=sys.stderr if level >= logging.WARNING else sys.stdout)
+
+    def lines(self, level: int = logging.NOTSET) -> list:
+        """Returns the buffered [(timestamp, level, text)] at or above level, oldest first."""
+        return [line for line in self._lines if line[1] >= level]
+
+    def _format(self, line: tuple) -> str:
+        timestamp, level, text = line
+        prefix = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        if level >= logging.WARNING:
+            prefix = f"{prefix} {logging.getLevelName(level)}"
+        return f"{prefix} {text}"
+
+    @Slot()
+    def flush(self):
+        if not self._pending:
+            return
+        lines = []
+        while self._pending:
+            lines.append(self._format(self._pending.popleft()))
+        self._view.appendPlainText("\n".join(lines))
+
+    @Slot()
+    def clear(self):
+        self._lines.clear()
+        self._pending.clear()
+        self._view.clear()
@@ -7,10 +7,10 @@ import sys
 import random
 import json
 import threading
+import logging
 
 from datetime import datetime, timedelta
 # from tkinter.ttk import Treeview
-from exiftool import ExifToolHelper
 
 from PySide6.QtWidgets import (
     QApplication,
@@ -23,20 +23,27 @@ from PySide6.QtWidgets import (
     QTreeWidgetItem,
 )
 from PySide6.QtGui import QDropEvent
-from PySide6.QtCore import QFile, Slot, Qt, QByteArray, QObject
+from PySide6.QtCore import QFile, Slot, Signal, Qt, QByteArray, QObject, QThread
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 
-from database import HashtagTable, CollectionsTable, Table, DatabaseExecution, UsersTable, UserTable
+from database import HashtagTable, CollectionsTable, Table, DatabaseExecution, UsersTable, UserTable, MetadataCacheTable, MediaTable
 from Inssist import InssistThread
+from rename_engine import RenameEngine
+from rename_worker import RenameWorker
+from rename_plan import RenameJournal
+from folder_watcher import FolderWatcher
+from log_sink import LogSink
+from plan_model import RenamePlanModel
 import time
 import common
 
-EXIFTOOL_FIELDS = ["QuickTime:CreationDate", "QuickTime:CreateDate",
-                   "Composite:SubSecDateTimeOriginal", "EXIF:DateTimeOriginal"]
+# rename output is also kept here, rotated, next to mediarename.db
+LOG_FILE = "mediamanager.log"
 
 
 class MainWindow(QMainWindow):
+    filesArrived = Signal(list)
 
     class TreeWidget(QObject):
         def __init__(self, parent, treeWidget) -> None:
@@ -142,7 +149,13 @@ class MainWindow(QMainWindow):
 
     def __init__(self):
         super(MainWindow, self).__init__()
-        self.exif = ExifToolHelper()
+        # created on the first rename, exiftool processes start only once files are read
+        self._renameEngine = None
+        self._mediaTable = MediaTable()
+        self._renameThread = None
+        self._renameWorker = None
+        self._folderWatcher = None
+        self._arrivedFiles = []
         self._collectionsTable = CollectionsTable()
         self._hashtags_table = HashtagTable()
         self._inssist = InssistThread.get()
@@ -161,8 +174,24 @@ class MainWindow(QMainWindow):
         self.ui = loader.load(ui_file, self)  # self.ui same as self.centralWidget()
         ui_file.close()
 
+        self._logSink = LogSink(self.ui.output, fileName=LOG_FILE, echo=True, parent=self)
+
+        self._planModel = RenamePlanModel(self)
+        # the last previewed plan and its folder, applied as shown by the next rename of that folder
+        self._previewedPlan = None
+        self._previewDirectory = None
+        self.ui.previewTable.setModel(self._planModel)
+        self.ui.previewTable.setSortingEnabled(True)
+        self.ui.previewTable.horizontalHeader().setStretchLastSection(True)
+        self.ui.previewButton.clicked.connect(self.previewButtonClicked)
+        self.ui.previewWarningsOnly.toggled.connect(self._planModel.setWarningsOnly)
+
         self.ui.renameButton.clicked.connect(self.renameButtonClicked)
-        self.ui.clearOutput.clicked.connect(self.ui.output.clear)
+        self.ui.pauseButton.clicked.connect(self.pauseButtonClicked)
+        self.ui.undoButton.clicked.connect(self.undoButtonClicked)
+        self.ui.watchFolder.toggled.connect(self.watchFolderToggled)
+        self.filesArrived.connect(self.renameArrivedFiles)
+        self.ui.clearOutput.clicked.connect(self._logSink.clear)
         self.ui.browseButton.clicked.connect(self.browse)
         self.ui.shuffle.clicked.connect(self.shuffleHashtags)
 
@@ -261,98 +290,150 @@ class MainWindow(QMainWindow):
 
     @Slot()
     def renameButtonClicked(self):
+        if self._renameWorker:
+            self._renameWorker.cancel()
+            return
+
         directory = Path(self.ui.path.text())
 
-        if directory.is_dir():
-            self.renameDirectory(directory)
-        elif directory.is_file():
-            self.renameFile(directory)
+        if not directory.exists():
+            return
+
+        plan = self._previewedPlan if directory == self._previewDirectory else None
+        self._previewedPlan = self._previewDirectory = None
+        if plan is not None:
+            self.log(f"Applying the previewed plan, {len(plan)} renames")
+            self._planModel.setPlan(None)
+            self.ui.previewSummary.setText("")
+        self.startRename(directory, plan=plan)
+
+    @Slot()
+    def previewButtonClicked(self):
+        directory = Path(self.ui.path.text())
+        if self._renameWorker or not directory.exists():
+            return
 
-    def renameDirectory(self, directory):
-        count = len(list(directory.glob('*')))
-        self.ui.fileProgress.setMaximum(count)
+        self._previewDirectory = directory
+        self.startRename(directory, preview=True)
+
+    @Slot(object)
+    def planPreviewed(self, plan):
+        self._previewedPlan = plan
+        self._planModel.setPlan(plan)
+        self.ui.previewSummary.setText(f"{len(plan)} renames, {len(plan.skipped)} skipped, "
+                                       f"{self._planModel.warnings} with warnings")
+
+    def startRename(self, directory: Path, filenames: list = None, preview: bool = False, plan: "RenamePlan" = None):
+        if not self._renameEngine:
+            self._renameEngine = RenameEngine(cache=MetadataCacheTable())
+
+        self._renameWorker = RenameWorker(self._renameEngine, directory,
+                                          djiPocketOffset=self.ui.dji_pocket.value(),
+                                          iphoneMovOffset=self.ui.iphone_mov.value(),
+                                          recursive=self.ui.recursive.isChecked(),
+                                          filenames=filenames,
+                                          catalog=self._mediaTable,
+                                          dedup=self.ui.dedup.isChecked(),
+                                          bursts=self.ui.bursts.isChecked(),
+                                          fixDates=self.ui.fixDates.isChecked(),
+                                          preview=preview,
+                                          renaming=self._folderWatcher.ignore if self._folderWatcher else None,
+                                          plan=plan)
+        self._renameThread = QThread(self)
+        self._renameWorker.moveToThread(self._renameThread)
+
+        self._renameThread.started.connect(self._renameWorker.run)
+        self._renameWorker.progress.connect(self.renameProgress)
+        self._renameWorker.message.connect(self.workerMessage)
+        self._renameWorker.planned.connect(self.planPreviewed)
+        self._renameWorker.finished.connect(self.renameFinished)
+
+        self.ui.fileProgress.setValue(0)
+        self.ui.renameButton.setText("Cancel")
+        self.ui.pauseButton.setEnabled(True)
+        self._renameThread.start()
 
-        for entry in sorted(directory.iterdir()):
-            self.ui.fileProgress.setValue(self.ui.fileProgress.value() + 1)
-            self.ui.currentFilename.setText(str(entry.name))
+    @Slot()
+    def pauseButtonClicked(self):
+        if not self._renameWorker:
+            return
 
-            if entry.name.startswith("__to_delete__"):
-                self.log(f"Ignoring {entry}, since it's marked to be deleted.")
-                continue
+        if self._renameWorker.paused:
+            self._renameWorker.resume()
+            self.ui.pauseButton.setText("Pause")
+        else:
+            self._renameWorker.pause()
+            self.ui.pauseButton.setText("Resume")
 
-            self.renameFile(entry)
-        self.ui.fileProgress.setValue(count)
+    @Slot(bool)
+    def watchFolderToggled(self, checked):
+        if self._folderWatcher:
+            self._folderWatcher.stop()
+            self._folderWatcher = None
 
-    def renameFile(self, filename):
-        extension = filename.suffix[1:].lower()
-        if extension not in ["jpg", "jpeg", "png", "mov", "mpg", "mpeg", "mp4"]:
+        directory = Path(self.ui.path.text())
+        if not checked or not directory.is_dir():
             return
 
-        metadata = self.exif.get_metadata(filename)
+        # called from the watcher thread, the signal brings the files over to the GUI thread
+        self._folderWatcher = FolderWatcher(directory, self.filesArrived.emit)
+        self._folderWatcher.start()
+        self.log(f"Watching {directory} for new files{' (polling)' if self._folderWatcher.polling else ''}")
 
-        if len(metadata) > 1:
-            self.log(f"{filename} has more then 1 metadata")
+    @Slot(list)
+    def renameArrivedFiles(self, filenames):
+        self._arrivedFiles += filenames
+        if self._renameWorker or not self._folderWatcher:
+            # picked up when the running rename finishes
+            return
 
-        metadata = metadata[0]
+        filenames, self._arrivedFiles = self._arrivedFiles, []
+        self.log(f"Renaming {len(filenames)} new files")
+        self.startRename(self._folderWatcher.directory, filenames)
 
-        new_filename = self.generate_filename(filename, metadata)
+    @Slot()
+    def undoButtonClicked(self):
+        if self._renameWorker:
+            return
 
-        if new_filename is None:
+        directory = Path(self.ui.path.text())
+        if directory.is_file():
+            directory = directory.parent
+        if not directory.is_dir():
             return
 
-        new_filename = f"{new_filename}.{extension}"
-        # self.log(str(filename.parent / new_filename))
-
-        # TODO: rename file here
-        os.rename(filename, filename.parent / new_filename)
-
-    def generate_filename(self, filename: Path, metadata: dict) -> str:
-        # If it's a file generated by instagram, then mark it to remove
-        if metadata.get("EXIF:Software") == "Instagram":
-            self.log(f"Consider marking {filename} __to_delete__")
-            return None
-        if metadata.get("QuickTime:Model") == "DJI Pocket":
-            date_result = metadata["QuickTime:CreateDate"]
-            dt = datetime.strptime(date_result, "%Y:%m:%d %H:%M:%S")
-            dt = dt + timedelta(hours=self.ui.dji_pocket.value())
-            return dt.strftime("%Y%m%d_%H%M%S")
-        elif metadata.get("QuickTime:Model") == "iPhone 12" and metadata["File:FileTypeExtension"].lower() == "mov":
-            date_result = metadata["QuickTime:CreationDate"]
-            if "+" in date_result:
-                date_result = date_result.split("+")[0]
-            dt = datetime.strptime(date_result, "%Y:%m:%d %H:%M:%S")
-            dt = dt + timedelta(hours=self.ui.iphone_mov.value())
-            return dt.strftime("%Y%m%d_%H%M%S")
-        elif "Composite:SubSecDateTimeOriginal" in metadata:
-            date_result = metadata["Composite:SubSecDateTimeOriginal"]
-            date_result = date_result.split("+")[0]
-            date_result, milisec = date_result.split(".")
-            dt = datetime.strptime(date_result, "%Y:%m:%d %H:%M:%S")
-            # dt = dt + timedelta(hours=self.ui.iphone_img.value())
-            return dt.strftime(f"%Y%m%d_%H%M%S_{milisec}")
-        elif "EXIF:DateTimeOriginal" in metadata:
-            date_result = metadata["EXIF:DateTimeOriginal"]
-            date_result = date_result.split("+")[0]
-            dt = datetime.strptime(date_result, "%Y:%m:%d %H:%M:%S")
-            # dt = dt + timedelta(hours=self.ui.iphone_img.value())
-            return dt.strftime("%Y%m%d_%H%M%S")
-        elif "QuickTime:CreateDate" in metadata:
-            date_result = metadata["QuickTime:CreateDate"]
-            date_result = date_result.split("+")[0]
-            try:
-                dt = datetime.strptime(date_result, "%Y:%m:%d %H:%M:%S")
-            except ValueError:
-                self.log(f"Invalid date: {date_result}")
-                return None
-            # dt = dt + timedelta(hours=self.ui.iphone_img.value())
-            return dt.strftime("%Y%m%d_%H%M%S")
-
-        self.log(f"Incomplete metadata  (no creation date): {filename}\n{metadata}")
-        return None
-
-    def log(self, text: str):
-        self.ui.output.setPlainText(self.ui.output.toPlainText() + "\n" + text)
-        print(text)
+        restored = RenameJournal(directory).undo()
+        self.log(f"Undo restored the previous name of {restored} files in {directory}")
+
+    @Slot(int, int, str, float)
+    def renameProgress(self, done, total, filename, rate):
+        self.ui.fileProgress.setMaximum(total)
+        self.ui.fileProgress.setValue(done)
+        self.ui.currentFilename.setText(filename)
+        self.ui.renameRate.setText(f"{rate:.1f} files/s")
+
+    @Slot()
+    def renameFinished(self):
+        self._renameThread.quit()
+        self._renameThread.wait()
+        self._renameWorker.deleteLater()
+        self._renameThread.deleteLater()
+        self._renameWorker = None
+        self._renameThread = None
+
+        self.ui.renameButton.setText("Rename")
+        self.ui.pauseButton.setText("Pause")
+        self.ui.pauseButton.setEnabled(False)
+
+        if self._arrivedFiles:
+            self.renameArrivedFiles([])
+
+    @Slot(int, str)
+    def workerMessage(self, level: int, text: str):
+        self.log(text, level)
+
+    def log(self, text: str, level: int = logging.INFO):
+        self._logSink.write(text, level)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,19 @@
+import os
+import hashlib
+
+# bytes read from each end of a file by sampleHash
+SAMPLE_SIZE = 64 * 1024
+
+
+def sampleHash(filename, size: int = None) -> str:
+    """Hashes the size plus the first and last SAMPLE_SIZE bytes, cheap enough to run on every renamed file."""
+    if size is None:
+        size = os.stat(filename).st_size
+
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filename, "rb") as file:
+        digest.update(file.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            file.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            digest.update(file.read(SAMPLE_SIZE))
+    return digest.hexdigest()
@@ -0,0 +1,212 @@
+import os
+import time
+from pathlib import Path
+
+MEDIA_EXTENSIONS = ["jpg", "jpeg", "png", "mov", "mpg", "mpeg", "mp4"]
+
+# prefix of files waiting to be deleted by hand, never renamed
+TO_DELETE_PREFIX = "__to_delete__"
+
+# rough size of a directory entry on disk, used to guess how many entries a directory holds
+AVERAGE_ENTRY_SIZE = 32
+
+# directories modified this recently, in ns, are listed again on the next incremental scan
+RACY_WINDOW = 2 * 1000 * 1000 * 1000
+
+
+class DirectoryScanner:
+    """Yields the media files under a directory with os.scandir, in a single pass and without stat calls.
+
+    Every directory is listed once, and its media files come out sorted by name before its
+    subdirectories are walked, so only one directory's names are held at a time.
+    """
+
+    def __init__(self, root: Path, extensions: list = MEDIA_EXTENSIONS, recursive: bool = False, ignored=None) -> None:
+        self._root = Path(root)
+        self._extensions = set(extensions)
+        self._recursive = recursive
+        self._ignored = ignored
+        self._scanned = 0
+        self._estimated = 0
+        self._found = 0
+
+    @property
+    def scanned(self) -> int:
+        """Directory entries looked at so far."""
+        return self._scanned
+
+    @property
+    def found(self) -> int:
+        """Media files yielded so far."""
+        return self._found
+
+    @property
+    def estimatedTotal(self) -> int:
+        """Best guess of how many media files the scan will yield, never below what was already found.
+
+        The entries left, guessed from the directory sizes, are expected to hold media files in the
+        same proportion as the entries already scanned.
+        """
+        left = max(self._estimated - self._scanned, 0)
+        if self._scanned:
+            left = left * self._found // self._scanned
+        return self._found + left
+
+    def _estimate(self, directory) -> int:
+        # local filesystems grow a directory's size with its entries, network ones usually report 0 or one block
+        try:
+            return os.stat(directory).st_size // AVERAGE_ENTRY_SIZE
+        except OSError:
+            return 0
+
+    def _accepts(self, name: str, path) -> bool:
+        if name.startswith(TO_DELETE_PREFIX):
+            if self._ignored:
+                self._ignored(str(path))
+            return False
+
+        extension = name.rpartition(".")[2].lower() if "." in name else ""
+        return extension in self._extensions
+
+    def _list(self, directory, pending: list):
+        # yields the media files of one directory, queueing its subdirectories when recursive
+        files = []
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                self._scanned += 1
+
+                if entry.is_dir(follow_symlinks=False):
+                    if self._recursive:
+                        subdirectories.append(entry.path)
+                        self._estimated += self._estimate(entry.path)
+                    continue
+
+                if self._accepts(entry.name, entry.path) and entry.is_file(follow_symlinks=False):
+                    files.append(entry.path)
+
+        # popped from the end, the first subdirectory by name goes last
+        pending += sorted(subdirectories, reverse=True)
+        for filename in sorted(files):
+            self._found += 1
+            yield Path(filename)
+
+    def __iter__(self):
+        if self._root.is_file():
+            self._estimated = 1
+            self._scanned = 1
+            if self._accepts(self._root.name, self._root):
+                self._found = 1
+                yield self._root
+            return
+
+        pending = [self._root]
+        self._estimated = self._estimate(self._root)
+        while pending:
+            yield from self._list(pending.pop(), pending)
+
+        # the scan is complete, the estimate is now exact
+        self._estimated = self._scanned
+
+
+class IncrementalScanner(DirectoryScanner):
+    """Recursive scan that only lists the directories changed since the fingerprints of the last one.
+
+    fingerprints is {path: (parent, mtime_ns)} for the directories under root. A directory whose
+    mtime didn't move has the same entries as last time, so it isn't listed and its subdirectories
+    come from the fingerprints instead, leaving one stat per unchanged directory.
+    """
+
+    def __init__(self, root: Path, fingerprints: dict, extensions: list = MEDIA_EXTENSIONS, ignored=None) -> None:
+        super().__init__(os.path.abspath(root), extensions, recursive=True, ignored=ignored)
+        self._known = fingerprints
+        self._children = {}
+        for path, (parent, _) in fingerprints.items():
+            self._children.setdefault(parent, []).append(path)
+        self.changed = []
+        self.removed = []
+
+    def _list(self, directory, pending: list):
+        yield from super()._list(directory, pending)
+        self.changed.append(directory)
+
+    def __iter__(self):
+        if self._root.is_file():
+            yield from super().__iter__()
+            return
+
+        self._estimated = self._estimate(self._root)
+        pending = [str(self._root)]
+        # directories queued from the fingerprints, their size wasn't looked at by a listing
+        unlisted = set()
+        visited = set()
+        while pending:
+            directory = pending.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            visited.add(directory)
+
+            known = self._known.get(directory)
+            if known and known[1] == mtime:
+                children = self._children.get(directory, [])
+                pending += sorted(children, reverse=True)
+                unlisted.update(children)
+                continue
+
+            if directory in unlisted:
+                self._estimated += self._estimate(directory)
+            yield from self._list(directory, pending)
+
+        self.removed = [directory for directory in self._known if directory not in visited]
+        self._estimated = self._scanned
+
+    def fingerprints(self) -> dict:
+        """Fingerprints of the directories listed by the scan, to store once their files are dealt with.
+
+        mtimes are read again, so renames applied since the scan don't count as changes next time.
+        """
+        result = {}
+        now = time.time_ns()
+        for directory in self.changed:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            if now - mtime < RACY_WINDOW:
+                # could still change within the filesystem's mtime granularity, list it again next time
+                mtime = 0
+            result[directory] = (os.path.dirname(directory), mtime)
+        return result
+
+
+class FileList:
+    """A known list of files behind the DirectoryScanner interface, as handed over by the folder watcher.
+
+    Files gone by the time they're reached, renamed away by dedup or an earlier run, are skipped.
+    """
+
+    def __init__(self, filenames: list) -> None:
+        self._filenames = list(filenames)
+        self._scanned = 0
+        self._found = 0
+
+    @property
+    def scanned(self) -> int:
+        return self._scanned
+
+    @property
+    def found(self) -> int:
+        return self._found
+
+    @property
+    def estimatedTotal(self) -> int:
+        return len(self._filenames) - (self._scanned - self._found)
+
+    def __iter__(self):
+        for filename in self._filenames:
+            self._scanned += 1
+            if os.path.exists(filename):
+                self._found += 1
+                yield Path(filename)
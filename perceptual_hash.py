@@ -0,0 +1,124 @@
+import os
+import sys
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import dhash_worker
+from dhash_worker import dHash
+
+# pictures whose hashes differ in at most this many bits are taken for the same shot
+BURST_RADIUS = 10
+
+# and only when they were shot at most this many seconds apart
+BURST_WINDOW = 60.0
+
+PERCEPTUAL_EXTENSIONS = ["jpg", "jpeg", "png"]
+
+
+@contextmanager
+def _workerMain():
+    # spawned processes import the parent's __main__ first, mainwindow and all of the GUI in the
+    # application, while they start they're told it's the hashing module instead
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = dhash_worker
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def hammingDistance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+def hashImages(filenames: list, workers: int = None) -> dict:
+    """Returns {filename: dHash} for the pictures that could be decoded, hashing them in a process pool."""
+    filenames = list(filenames)
+    if not filenames:
+        return {}
+
+    workers = workers or os.cpu_count() or 1
+    # forking a process that runs Qt threads isn't safe, the workers start fresh
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # map submits every chunk, starting the processes, before it returns
+        with _workerMain():
+            hashes = executor.map(dHash, filenames, chunksize=max(1, len(filenames) // (workers * 4)))
+        return {filename: value for filename, value in zip(filenames, hashes) if value is not None}
+
+
+class BKTree:
+    """Burkhard-Keller tree over hashes, finds every hash within a Hamming radius without comparing against all of them."""
+
+    def __init__(self) -> None:
+        # a node is (hash, values, {distance: child})
+        self._root = None
+
+    def add(self, value: int, item):
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+
+        node = self._root
+        while True:
+            distance = hammingDistance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list:
+        result = []
+        pending = [self._root] if self._root else []
+        while pending:
+            node = pending.pop()
+            distance = hammingDistance(value, node[0])
+            if distance <= radius:
+                result += node[1]
+            # by the triangle inequality, matches can only live under these children
+            for childDistance, child in node[2].items():
+                if distance - radius <= childDistance <= distance + radius:
+                    pending.append(child)
+        return result
+
+
+def _shotTogether(first, second, window: float) -> bool:
+    return first is not None and second is not None and abs((first - second).total_seconds()) <= window
+
+
+def groupNearDuplicates(hashes: dict, radius: int = BURST_RADIUS, times: dict = None, window: float = BURST_WINDOW) -> list:
+    """Groups the keys of {filename: hash} whose hashes are within radius of each other, directly or through
+    other members, every group sorted by name so the first shot of a burst comes first.
+
+    With times ({filename: datetime or None}), two pictures are only grouped when both were shot at
+    most window seconds apart.
+    """
+    tree = BKTree()
+    for filename, value in hashes.items():
+        tree.add(value, filename)
+
+    parents = {}
+
+    def root(filename):
+        while parents.get(filename, filename) != filename:
+            parents[filename] = parents.get(parents[filename], parents[filename])
+            filename = parents[filename]
+        return filename
+
+    for filename, value in hashes.items():
+        for other in tree.search(value, radius):
+            if times is not None and not _shotTogether(times.get(filename), times.get(other), window):
+                continue
+            first, second = root(filename), root(other)
+            if first != second:
+                parents[second] = first
+
+    groups = {}
+    for filename in hashes:
+        groups.setdefault(root(filename), []).append(filename)
+    return [sorted(group, key=lambda filename: os.path.basename(filename)) for group in groups.values() if len(group) > 1]
@@ -0,0 +1,98 @@
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from rename_plan import RenamePlan
+
+# rows handed to the view every time it scrolls to the end of what it has
+FETCH_SIZE = 500
+
+
+class RenamePlanModel(QAbstractTableModel):
+    """Table of a rename plan for a QTableView, old name, new name, rule and warnings, skipped files included.
+
+    Rows are an index array into the plan entries, so sorting only reorders integers and showing
+    just the rows with warnings swaps in a second array kept next to it. The view is given rows
+    FETCH_SIZE at a time as it scrolls.
+    """
+
+    COLUMNS = ["Old name", "New name", "Rule", "Warnings"]
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._entries = []
+        self._order = []
+        self._warned = []
+        self._warningsOnly = False
+        self._loaded = 0
+
+    @property
+    def _rows(self) -> list:
+        return self._warned if self._warningsOnly else self._order
+
+    def _value(self, entry, column: int) -> str:
+        if column == 0:
+            return entry.source.name
+        if column == 1:
+            return entry.targetName
+        if column == 2:
+            return entry.rule or ""
+        return "; ".join(entry.warnings)
+
+    def _reset(self, order: list):
+        self.beginResetModel()
+        self._order = order
+        self._warned = [row for row in order if self._entries[row].warnings]
+        self._loaded = min(max(self._loaded, FETCH_SIZE), len(self._rows))
+        self.endResetModel()
+
+    def setPlan(self, plan: RenamePlan|None):
+        self._entries = list(plan) + plan.skipped if plan is not None else []
+        self._loaded = 0
+        self._reset(list(range(len(self._entries))))
+
+    def setWarningsOnly(self, warningsOnly: bool):
+        self.beginResetModel()
+        self._warningsOnly = warningsOnly
+        self._loaded = min(FETCH_SIZE, len(self._rows))
+        self.endResetModel()
+
+    @property
+    def warnings(self) -> int:
+        return len(self._warned)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(RenamePlanModel.COLUMNS)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(FETCH_SIZE, len(self._rows) - self._loaded)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self._loaded:
+            return None
+
+        entry = self._entries[self._rows[index.row()]]
+        if role == Qt.DisplayRole:
+            return self._value(entry, index.column())
+        if role == Qt.ToolTipRole:
+            return f"{entry.source}\n{entry.target}" if entry.target else str(entry.source)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return RenamePlanModel.COLUMNS[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        entries = self._entries
+        self._reset(sorted(range(len(entries)), key=lambda row: self._value(entries[row], column),
+                           reverse=order == Qt.DescendingOrder))
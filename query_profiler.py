@@ -0,0 +1,128 @@
+import time
+import bisect
+import logging
+import threading
+from collections import deque
+
+from PySide6.QtSql import QSqlQuery
+
+from database import DatabaseManager, DatabaseExecution
+
+# upper bounds of the duration buckets, in seconds, slower executions go in one last bucket
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0]
+
+# executions at least this slow, in seconds, are logged
+SLOW_QUERY_TIME = 0.05
+
+# slow executions kept in memory
+SLOW_QUERY_LOG = 200
+
+# statements EXPLAIN QUERY PLAN is run for
+EXPLAINED = ("SELECT", "UPDATE", "DELETE", "INSERT")
+
+
+class StatementStats:
+    """Executions of one SQL text, their durations bucketed by BUCKETS."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.rows = 0
+        self.binds = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        # plan lines of the full table scans EXPLAIN QUERY PLAN found, None when it wasn't run
+        self.scans = None
+
+    def add(self, binds: int, seconds: float, rows: int):
+        self.count += 1
+        self.total += seconds
+        self.slowest = max(self.slowest, seconds)
+        self.rows += rows
+        self.binds = binds
+        self.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+class QueryProfiler:
+    """Tracer for DatabaseExecution keeping per statement timings and a log of the slow executions.
+
+    Nothing is measured until install() is called, uninstall() puts the database back to a single
+    None check per execution. With explain, the first execution of every statement is followed by
+    an EXPLAIN QUERY PLAN and the full table scans it shows are logged.
+    """
+
+    def __init__(self, slowTime: float = SLOW_QUERY_TIME, explain: bool = False, logger: logging.Logger = None) -> None:
+        self._slowTime = slowTime
+        self._explain = explain
+        self._logger = logger or logging.getLogger("mediamanager.sql")
+        self._lock = threading.Lock()
+        self._statements = {}
+        self.slowQueries = deque(maxlen=SLOW_QUERY_LOG)
+
+    def install(self) -> "QueryProfiler":
+        DatabaseExecution.tracer = self
+        return self
+
+    def uninstall(self):
+        if DatabaseExecution.tracer is self:
+            DatabaseExecution.tracer = None
+
+    def __call__(self, sql: str, params: list, seconds: float, rows: int):
+        with self._lock:
+            stats = self._statements.get(sql)
+            first = stats is None
+            if first:
+                stats = self._statements[sql] = StatementStats()
+            stats.add(len(params), seconds, rows)
+            if seconds >= self._slowTime:
+                self.slowQueries.append((time.time(), sql, len(params), seconds, rows))
+
+        if seconds >= self._slowTime:
+            self._logger.warning(f"Slow query, {seconds * 1000:.1f} ms for {rows} rows: {sql}")
+        if first and self._explain:
+            stats.scans = self._scans(sql, params)
+            for scan in stats.scans:
+                self._logger.warning(f"Full table scan ({scan}): {sql}")
+
+    def _scans(self, sql: str, params: list) -> list:
+        if not sql.lstrip().upper().startswith(EXPLAINED):
+            return []
+        # straight on the connection, through DatabaseExecution it would be traced too
+        query = QSqlQuery(DatabaseManager.get().database)
+        if not query.prepare(f"EXPLAIN QUERY PLAN {sql}"):
+            return []
+        for index, param in enumerate(params):
+            query.bindValue(index, param)
+        if not query.exec():
+            return []
+
+        scans = []
+        while query.next():
+            # the detail column reads "SCAN media" or "SCAN TABLE media", index scans say what they are USING
+            detail = str(query.value(query.record().indexOf("detail")))
+            if detail.startswith("SCAN") and " USING " not in detail and "CONSTANT ROW" not in detail:
+                scans.append(detail)
+        query.finish()
+        return scans
+
+    @property
+    def statements(self) -> dict:
+        """{sql: StatementStats} of every statement seen so far."""
+        with self._lock:
+            return dict(self._statements)
+
+    def clear(self):
+        with self._lock:
+            self._statements = {}
+            self.slowQueries.clear()
+
+    def report(self, limit: int = 20) -> str:
+        """The statements that took the most time overall, one per line."""
+        statements = sorted(self.statements.items(), key=lambda item: item[1].total, reverse=True)
+        lines = [f"{len(statements)} statements, {sum(stats.count for _, stats in statements)} executions"]
+        for sql, stats in statements[:limit]:
+            histogram = " ".join(str(count) for count in stats.histogram)
+            scan = " SCAN" if stats.scans else ""
+            lines.append(f"{stats.total * 1000:10.1f} ms {stats.count:7}x {stats.total / stats.count * 1000:8.3f} avg "
+                         f"{stats.slowest * 1000:8.3f} max {stats.rows:8} rows [{histogram}]{scan} {' '.join(sql.split())}")
+        return "\n".join(lines)
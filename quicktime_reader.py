@@ -0,0 +1,180 @@
+import re
+import struct
+from datetime import datetime, timedelta
+
+# QuickTime dates count seconds from this epoch
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+
+XMP_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})T(\d{2}:\d{2}:\d{2})(.*)$")
+TIMEZONE = re.compile(r"([-+]\d{2})(\d{2})$")
+
+KEY_MODEL = "com.apple.quicktime.model"
+KEY_CREATION_DATE = "com.apple.quicktime.creationdate"
+
+# udta atom holding the camera model, used by DJI
+UDTA_MODEL = b"\xa9mdl"
+
+# largest metadata atom read into memory, anything bigger isn't what we're after
+MAX_ATOM_SIZE = 1024 * 1024
+
+
+def _atoms(file, start: int, end: int):
+    # yields (type, payload start, payload end) for the atoms between start and end, seeking over their contents
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        size, type = struct.unpack(">I4s", header)
+        headerSize = 8
+        if size == 1:
+            extended = file.read(8)
+            if len(extended) < 8:
+                return
+            size = struct.unpack(">Q", extended)[0]
+            headerSize = 16
+        elif size == 0:
+            size = end - position
+        if size < headerSize:
+            return
+        yield type, position + headerSize, min(position + size, end)
+        position += size
+
+
+def _read(file, start: int, end: int) -> bytes|None:
+    if end - start > MAX_ATOM_SIZE:
+        return None
+    file.seek(start)
+    return file.read(end - start)
+
+
+def _formatDate(seconds: int) -> str|None:
+    # None for a date past what datetime holds, a garbled 64 bit mvhd
+    if not seconds:
+        return "0000:00:00 00:00:00"
+    try:
+        return (QUICKTIME_EPOCH + timedelta(seconds=seconds)).strftime("%Y:%m:%d %H:%M:%S")
+    except (OverflowError, ValueError):
+        return None
+
+
+def _formatXmpDate(value: str) -> str:
+    match = XMP_DATE.match(value)
+    if not match:
+        return value
+    year, month, day, time, rest = match.groups()
+    rest = TIMEZONE.sub(r"\1:\2", rest)
+    return f"{year}:{month}:{day} {time}{rest}"
+
+
+def _parseMvhd(data: bytes) -> int|None:
+    if len(data) < 12:
+        return None
+    if data[0] == 1:
+        return struct.unpack_from(">Q", data, 4)[0]
+    return struct.unpack_from(">I", data, 4)[0]
+
+
+def _parseMeta(file, start: int, end: int) -> dict:
+    # QuickTime writes meta as a plain atom, MP4 as a full box with 4 bytes of version and flags
+    file.seek(start + 4)
+    if file.read(4) != b"hdlr":
+        start += 4
+
+    keys = []
+    items = {}
+    for type, payloadStart, payloadEnd in _atoms(file, start, end):
+        if type == b"keys":
+            data = _read(file, payloadStart, payloadEnd)
+            if not data or len(data) < 8:
+                continue
+            count = struct.unpack_from(">I", data, 4)[0]
+            position = 8
+            for _ in range(count):
+                if position + 8 > len(data):
+                    break
+                size = struct.unpack_from(">I", data, position)[0]
+                if size < 8:
+                    break
+                keys.append(data[position + 8:position + size].decode("utf-8", "replace"))
+                position += size
+        elif type == b"ilst":
+            for item, itemStart, itemEnd in _atoms(file, payloadStart, payloadEnd):
+                index = struct.unpack(">I", item)[0]
+                for child, dataStart, dataEnd in _atoms(file, itemStart, itemEnd):
+                    if child != b"data":
+                        continue
+                    data = _read(file, dataStart, dataEnd)
+                    # type indicator 1 is UTF-8 text
+                    if data and len(data) >= 8 and struct.unpack_from(">I", data, 0)[0] == 1:
+                        items[index] = data[8:].decode("utf-8", "replace")
+                    break
+
+    return {keys[index - 1]: value for index, value in items.items() if 0 < index <= len(keys)}
+
+
+def _parseUdtaModel(file, start: int, end: int) -> str|None:
+    for type, payloadStart, payloadEnd in _atoms(file, start, end):
+        if type != UDTA_MODEL:
+            continue
+        data = _read(file, payloadStart, payloadEnd)
+        if not data or len(data) < 4:
+            return None
+        length = struct.unpack_from(">H", data, 0)[0]
+        return data[4:4 + length].split(b"\0")[0].decode("utf-8", "replace").rstrip()
+    return None
+
+
+def readQuickTimeMetadata(filename) -> dict|None:
+    """Reads the tags generate_filename uses from the moov atom of a MOV/MP4, named as exiftool -G -n would.
+
+    Only atom headers, mvhd and the moov/meta and moov/udta atoms are read, wherever moov sits in the file.
+    Returns None without a movie header, a known file type or a camera model, so the caller can ask exiftool instead.
+    """
+    try:
+        with open(filename, "rb") as file:
+            file.seek(0, 2)
+            fileSize = file.tell()
+
+            extension = None
+            createDate = None
+            keys = {}
+            udtaModel = None
+            for type, start, end in _atoms(file, 0, fileSize):
+                if type == b"ftyp":
+                    file.seek(start)
+                    brand = file.read(4)
+                    if brand == b"qt  ":
+                        extension = "mov"
+                    elif brand[:3] in (b"mp4", b"iso", b"avc"):
+                        extension = "mp4"
+                elif type == b"moov":
+                    for child, childStart, childEnd in _atoms(file, start, end):
+                        if child == b"mvhd":
+                            createDate = _parseMvhd(_read(file, childStart, childEnd) or b"")
+                        elif child == b"meta":
+                            keys.update(_parseMeta(file, childStart, childEnd))
+                        elif child == b"udta":
+                            udtaModel = _parseUdtaModel(file, childStart, childEnd)
+                    break
+    except (OSError, struct.error):
+        return None
+
+    model = keys.get(KEY_MODEL) or udtaModel
+    if createDate is None or extension is None or not model:
+        return None
+    createDate = _formatDate(createDate)
+    if createDate is None:
+        return None
+
+    result = {
+        "SourceFile": str(filename),
+        "File:FileTypeExtension": extension,
+        "QuickTime:CreateDate": createDate,
+        "QuickTime:Model": model,
+    }
+    if KEY_CREATION_DATE in keys:
+        result["QuickTime:CreationDate"] = _formatXmpDate(keys[KEY_CREATION_DATE])
+
+    return result
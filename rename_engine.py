@@ -0,0 +1,317 @@
+import os
+import csv
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from exiftool import ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteError, ExifToolProcessStateError, ExifToolOutputEmptyError, ExifToolJSONInvalidError
+
+from exif_reader import readJpegMetadata
+from quicktime_reader import readQuickTimeMetadata
+from file_type import sniff
+
+EXIFTOOL_FIELDS = ["QuickTime:CreationDate", "QuickTime:CreateDate",
+                   "Composite:SubSecDateTimeOriginal", "EXIF:DateTimeOriginal",
+                   "EXIF:Software", "EXIF:Model", "QuickTime:Model", "File:FileTypeExtension"]
+
+# readers used before starting exiftool, by file type as told by file_type.sniff
+FAST_PATH_READERS = {
+    "jpg": readJpegMetadata,
+    "mov": readQuickTimeMetadata,
+    "mp4": readQuickTimeMetadata,
+}
+
+# number of files sent to exiftool in a single call
+RENAME_BATCH_SIZE = 200
+
+# number of files looked up in, or written to, the metadata cache at once
+CACHE_BATCH_SIZE = 500
+
+# seconds an exiftool process may stay idle before it is stopped
+IDLE_TIMEOUT = 60.0
+
+# times a batch is sent again after its exiftool process died
+RESTART_ATTEMPTS = 1
+
+# what a dead or garbled exiftool process raises
+EXIFTOOL_CRASHES = (ExifToolProcessStateError, ExifToolOutputEmptyError, ExifToolJSONInvalidError, OSError)
+
+
+class ExifToolPool:
+    """Up to size exiftool -stay_open processes shared between worker threads.
+
+    Processes are started on first use and stopped after IDLE_TIMEOUT seconds without work, so
+    sessions that never rename don't pay for them. A process that dies mid-batch is replaced and
+    the batch is sent again.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def get():
+        if not ExifToolPool.__instance:
+            ExifToolPool.__instance = ExifToolPool()
+        return ExifToolPool.__instance
+
+    def __init__(self, size: int = None, idleTimeout: float = IDLE_TIMEOUT) -> None:
+        self._size = size or os.cpu_count() or 1
+        self._idleTimeout = idleTimeout
+        self._condition = threading.Condition()
+        # [(helper, released at)], the most recently used last
+        self._idle = []
+        self._started = 0
+        self._reaper = None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def running(self) -> int:
+        return self._started
+
+    def _acquire(self) -> ExifToolHelper:
+        with self._condition:
+            while not self._idle and self._started >= self._size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()[0]
+
+            self._started += 1
+            if not self._reaper:
+                self._reaper = threading.Thread(target=self._reap, name="exiftool reaper", daemon=True)
+                self._reaper.start()
+        try:
+            # the process itself starts on the first command
+            return ExifToolHelper()
+        except Exception as error:
+            # exiftool isn't installed, give the slot back so the next caller fails too instead of waiting
+            with self._condition:
+                self._started -= 1
+                self._condition.notify_all()
+            raise Exception(f"Couldn't start exiftool: {error}") from error
+
+    def _release(self, helper: ExifToolHelper):
+        with self._condition:
+            self._idle.append((helper, time.monotonic()))
+            self._condition.notify_all()
+
+    def _discard(self, helper: ExifToolHelper):
+        self._stop([helper])
+        with self._condition:
+            self._started -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def helper(self):
+        helper = self._acquire()
+        try:
+            yield helper
+        except EXIFTOOL_CRASHES:
+            self._discard(helper)
+            raise
+        except BaseException:
+            self._release(helper)
+            raise
+        self._release(helper)
+
+    def _retry(self, command):
+        # runs command(helper) on any free process, again on a new one if the process dies
+        for attempt in range(RESTART_ATTEMPTS + 1):
+            try:
+                with self.helper() as exif:
+                    return command(exif)
+            except EXIFTOOL_CRASHES:
+                if attempt == RESTART_ATTEMPTS:
+                    raise
+
+    def getTags(self, filenames, tags: list) -> list:
+        return self._retry(lambda exif: exif.get_tags(filenames, tags))
+
+    def execute(self, *params) -> str:
+        return self._retry(lambda exif: exif.execute(*params))
+
+    def _stop(self, helpers: list):
+        # outside the lock, a process can take a while to shut down
+        for helper in helpers:
+            try:
+                helper.terminate()
+            except Exception:
+                pass
+
+    def _reap(self):
+        while True:
+            expired = []
+            with self._condition:
+                if not self._started:
+                    self._reaper = None
+                    return
+                now = time.monotonic()
+                # idle is in release order, the oldest first
+                while self._idle and now - self._idle[0][1] >= self._idleTimeout:
+                    expired.append(self._idle.pop(0)[0])
+                    self._started -= 1
+                if expired:
+                    self._condition.notify_all()
+                else:
+                    self._condition.wait(self._idleTimeout / 2)
+            self._stop(expired)
+
+    def terminate(self):
+        """Stops the idle processes, busy ones keep running until they are released and time out."""
+        with self._condition:
+            idle = [helper for helper, _ in self._idle]
+            self._started -= len(idle)
+            self._idle = []
+            self._condition.notify_all()
+        self._stop(idle)
+
+
+class RenameEngine:
+    """Reads rename metadata for many files at once, spread over a pool of exiftool processes."""
+
+    def __init__(self, workers: int = None, batchSize: int = RENAME_BATCH_SIZE, cache: "MetadataCacheTable" = None,
+                 readers: dict = FAST_PATH_READERS) -> None:
+        # a given number of workers gets its own pool, the default shares the application one
+        self._pool = ExifToolPool(workers) if workers else ExifToolPool.get()
+        self._executor = ThreadPoolExecutor(max_workers=self._pool.size, thread_name_prefix="exiftool")
+        self._batchSize = batchSize
+        self._cache = cache
+        self._readers = readers
+
+    @property
+    def workers(self) -> int:
+        return self._pool.size
+
+    def _readBatch(self, filenames: list) -> list:
+        metadata = {}
+        remaining = []
+        for filename in filenames:
+            # the header, not the extension, decides, files that aren't media never reach exiftool
+            kind = sniff(filename)
+            if kind is None:
+                continue
+
+            reader = self._readers.get(kind)
+            record = reader(filename) if reader else None
+            if record:
+                metadata[record["SourceFile"]] = record
+            else:
+                remaining.append(str(filename))
+
+        if remaining:
+            try:
+                records = self._pool.getTags(remaining, EXIFTOOL_FIELDS)
+            except (ExifToolExecuteError, *EXIFTOOL_CRASHES):
+                # one bad file fails the whole call, retry them one by one
+                records = []
+                for filename in remaining:
+                    try:
+                        records += self._pool.getTags(filename, EXIFTOOL_FIELDS)
+                    except (ExifToolExecuteError, *EXIFTOOL_CRASHES):
+                        pass
+
+            for record in records:
+                metadata[record["SourceFile"]] = record
+
+        return [(filename, metadata.get(str(filename))) for filename in filenames]
+
+    def _readUncached(self, filenames: list):
+        if not filenames:
+            return
+
+        # keep every worker busy even on small directories
+        size = min(self._batchSize, -(-len(filenames) // self._pool.size))
+        batches = [filenames[index:index + size] for index in range(0, len(filenames), size)]
+
+        for results in self._executor.map(self._readBatch, batches):
+            yield from results
+
+    def _lookupCache(self, filenames: list):
+        stats = {}
+        cached = {}
+        batch = {}
+        for filename in filenames:
+            try:
+                stats[filename] = batch[filename] = os.stat(filename)
+            except OSError:
+                continue
+
+            if len(batch) >= CACHE_BATCH_SIZE:
+                cached.update(self._cache.lookup(batch))
+                batch = {}
+
+        if batch:
+            cached.update(self._cache.lookup(batch))
+        return stats, cached
+
+    def metadata(self, filenames: list):
+        """Yields (filename, metadata) in the same order as filenames, metadata is None when unreadable."""
+        if not filenames:
+            return
+
+        stats, cached = self._lookupCache(filenames) if self._cache else ({}, {})
+        results = self._readUncached([filename for filename in filenames if filename not in cached])
+
+        pending = []
+        try:
+            for filename in filenames:
+                if filename in cached:
+                    yield filename, cached[filename]
+                    continue
+
+                filename, metadata = next(results)
+                if metadata is not None and filename in stats:
+                    pending.append((stats[filename], metadata))
+                    if len(pending) >= CACHE_BATCH_SIZE:
+                        self._cache.store(pending)
+                        pending = []
+                yield filename, metadata
+        finally:
+            results.close()
+            if self._cache and pending:
+                self._cache.store(pending)
+
+    def evictCache(self):
+        """Drops the stale metadata cache entries, once a run is done with the cache."""
+        if self._cache:
+            self._cache.evict()
+
+    def terminate(self):
+        self._executor.shutdown()
+        self._pool.terminate()
+
+    def _writeBatch(self, batch: list) -> list:
+        # one exiftool call importing a CSV of the new values, returns the files it failed on
+        tags = sorted({tag for _, values in batch for tag in values})
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", encoding="utf-8", delete=False) as file:
+            writer = csv.writer(file)
+            writer.writerow(["SourceFile"] + tags)
+            for filename, values in batch:
+                # empty cells are ignored by exiftool
+                writer.writerow([str(filename)] + [values.get(tag, "") for tag in tags])
+
+        try:
+            try:
+                self._pool.execute(f"-csv={file.name}", "-overwrite_original", "-P", *[str(filename) for filename, _ in batch])
+                return []
+            except (ExifToolExecuteError, *EXIFTOOL_CRASHES):
+                if len(batch) == 1:
+                    return [batch[0][0]]
+            # one bad file fails the whole call, find it
+            return [failed for entry in batch for failed in self._writeBatch([entry])]
+        finally:
+            os.unlink(file.name)
+
+    def writeTags(self, values: dict) -> list:
+        """Writes {filename: {tag: value}} in place with one exiftool call per batch, returns the files that failed."""
+        entries = list(values.items())
+        if not entries:
+            return []
+
+        size = min(self._batchSize, -(-len(entries) // self._pool.size))
+        batches = [entries[index:index + size] for index in range(0, len(entries), size)]
+        return [failed for result in self._executor.map(self._writeBatch, batches) for failed in result]
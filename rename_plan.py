@@ -0,0 +1,289 @@
+import os
+import json
+import time
+from pathlib import Path
+
+# journal kept in the renamed directory, one JSON object per line
+JOURNAL_NAME = ".mediamanager_journal.jsonl"
+
+# length of the %Y%m%d_%H%M%S every planned name starts with, names in a directory are indexed by it
+STEM_LENGTH = 15
+
+
+class PlanEntry:
+    def __init__(self, source: Path, targetName: str, warnings: list = None, rule: str = None, directory: Path = None) -> None:
+        self.source = source
+        self.targetName = targetName
+        self.warnings = warnings or []
+        # name of the rename rule the target name came from
+        self.rule = rule
+        # where the file goes when it leaves its folder, as on import
+        self.directory = directory
+
+    @property
+    def target(self) -> Path|None:
+        if not self.targetName:
+            # a skipped file
+            return None
+        if self.directory is not None:
+            return Path(self.directory) / self.targetName
+        return self.source.with_name(self.targetName)
+
+
+class RenamePlan:
+    """Every rename of a run, computed before anything touches the disk.
+
+    Target names never collide with each other nor with a file already in the directory: the second
+    file shot in the same second becomes name_1.ext, the third name_2.ext and so on. Files left as
+    they are go to skipped, as entries without a target name whose warnings say why. Iterating the
+    plan only gives the renames.
+    """
+
+    def __init__(self) -> None:
+        self._entries = []
+        self._occupied = {}
+        self._stems = {}
+        self._nextSuffix = {}
+        self.skipped = []
+        # (filename, new name, metadata) of the planned files, for the catalog once applied
+        self.named = []
+        # (filename, tag, value, how) of the guessed capture dates to write before renaming
+        self.dates = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def _occupiedNames(self, directory: str) -> set:
+        names = self._occupied.get(directory)
+        if names is None:
+            try:
+                names = set(os.listdir(directory or "."))
+            except FileNotFoundError:
+                # created when the plan is applied
+                names = set()
+            self._occupied[directory] = names
+            stems = self._stems[directory] = {}
+            for filename in names:
+                stems.setdefault(filename[:STEM_LENGTH], []).append(filename)
+        return names
+
+    def _occupy(self, directory: str, filename: str):
+        self._occupied[directory].add(filename)
+        self._stems[directory].setdefault(filename[:STEM_LENGTH], []).append(filename)
+
+    @staticmethod
+    def _hasName(filename: str, name: str, extension: str) -> bool:
+        # name.ext or name_N.ext, what an earlier run would have produced
+        if not filename.endswith(f".{extension}") or not filename.startswith(name):
+            return False
+        suffix = filename[len(name):-len(extension) - 1]
+        return not suffix or (suffix[0] == "_" and suffix[1:].isdigit())
+
+    def existing(self, directory: Path, name: str, extension: str) -> list:
+        """Names already in directory, or planned there, that an earlier run would have given to name.ext."""
+        directory = str(directory)
+        self._occupiedNames(directory)
+        return [filename for filename in self._stems[directory].get(name[:STEM_LENGTH], [])
+                if self._hasName(filename, name, extension)]
+
+    def add(self, source: Path, name: str, extension: str, rule: str = None, directory: Path = None) -> PlanEntry|None:
+        """Plans source to be renamed to name.ext, returns None when it already has that name.
+
+        With a directory, source is planned to go there instead of staying in its folder.
+        """
+        destination = directory
+        if destination is None:
+            directory, _, filename = str(source).rpartition(os.sep)
+            if self._hasName(filename, name, extension):
+                return None
+        else:
+            directory = str(destination)
+
+        occupied = self._occupiedNames(directory)
+        key = (directory, name, extension)
+        suffix = self._nextSuffix.get(key, 0)
+        target = f"{name}.{extension}" if not suffix else f"{name}_{suffix}.{extension}"
+        while target in occupied:
+            suffix += 1
+            target = f"{name}_{suffix}.{extension}"
+        self._nextSuffix[key] = suffix + 1
+        self._occupy(directory, target)
+
+        entry = PlanEntry(source, target, rule=rule, directory=destination)
+        if suffix:
+            entry.warnings.append(f"{name}.{extension} is taken, using {target}")
+        self._entries.append(entry)
+        return entry
+
+    def skip(self, source: Path, warning: str, rule: str = None) -> PlanEntry:
+        entry = PlanEntry(source, "", [warning], rule)
+        self.skipped.append(entry)
+        return entry
+
+    def remove(self, sources: set):
+        """Drops the renames of sources, when something they depended on failed, they keep no capture date."""
+        self._entries = [entry for entry in self._entries if entry.source not in sources]
+        self.named = [(filename, None if filename in sources else name, metadata) for filename, name, metadata in self.named]
+
+    def drop(self, sources: set):
+        """Forgets sources altogether, when they were moved away since the plan was made."""
+        self._entries = [entry for entry in self._entries if entry.source not in sources]
+        self.skipped = [entry for entry in self.skipped if entry.source not in sources]
+        self.named = [named for named in self.named if named[0] not in sources]
+        self.dates = [change for change in self.dates if change[0] not in sources]
+
+    def sources(self) -> set:
+        """Every file the plan looked at, renamed or not."""
+        return {entry.source for entry in self._entries + self.skipped} | {filename for filename, _, _ in self.named}
+
+    def apply(self, journal: "RenameJournal", cancelled=None, renaming=None) -> list:
+        """Renames every planned file, returns the warnings raised while doing it.
+
+        renaming, when given, is called with every target just before the file is renamed to it.
+        """
+        warnings = []
+        if not self._entries:
+            # nothing to rename, no run in the journal either
+            return warnings
+        journal.begin(self._entries)
+        for entry in self._entries:
+            if cancelled and cancelled():
+                warnings.append("Rename cancelled while applying the plan, run it again to resume.")
+                return warnings
+
+            if renaming:
+                renaming(entry.target)
+            warning = RenameJournal.rename(entry.source, entry.target)
+            if warning:
+                warnings.append(warning)
+        journal.end()
+        return warnings
+
+
+class RenameJournal:
+    """Append-only log of the renames applied to a directory.
+
+    Every run writes its whole plan before renaming anything and an end marker once done, so an
+    interrupted run can be finished and any run can be undone by looking at which side of each
+    rename exists on disk. Imports are logged the same way, as copy runs.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self._path = Path(directory) / JOURNAL_NAME
+        self._run = None
+
+    @staticmethod
+    def rename(source: Path, target: Path) -> str|None:
+        if not os.path.exists(source):
+            return f"{source} is gone, not renaming it"
+        if os.path.exists(target):
+            return f"{target} already exists, not renaming {source}"
+        os.rename(source, target)
+        return None
+
+    def _write(self, records: list):
+        with open(self._path, "a", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def begin(self, entries: list, copy: bool = False):
+        self._run = time.time_ns()
+        records = [{"run": self._run, "event": "begin", "count": len(entries), "copy": copy}]
+        # absolute, so the run can be resumed or undone from any working directory
+        records += [{"run": self._run, "source": os.path.abspath(entry.source), "target": os.path.abspath(entry.target)}
+                    for entry in entries]
+        self._write(records)
+
+    def recordTags(self, changes: list):
+        """Logs [(filename, tag, value, how)] written to files as a run of its own, once they are written."""
+        run = time.time_ns()
+        records = [{"run": run, "event": "begin", "count": 0}]
+        records += [{"run": run, "file": os.path.abspath(filename), "tag": tag, "value": value, "inferred": how}
+                    for filename, tag, value, how in changes]
+        records.append({"run": run, "event": "end"})
+        self._write(records)
+
+    def end(self):
+        self._write([{"run": self._run, "event": "end"}])
+        self._run = None
+
+    def runs(self) -> list:
+        """Returns [(run, renames, finished, copied)] in the order they were applied, leaving out undone imports."""
+        if not self._path.exists():
+            return []
+
+        runs = {}
+        with open(self._path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a crash can leave a half written last line
+                    continue
+                run = runs.setdefault(record["run"], [record["run"], [], False, False])
+                event = record.get("event")
+                if event == "begin":
+                    run[3] = record.get("copy", False)
+                elif event == "end":
+                    run[2] = True
+                elif event == "undone":
+                    run[1] = None
+                elif "source" in record:
+                    run[1].append((Path(record["source"]), Path(record["target"])))
+        return [tuple(run) for run in runs.values() if run[1] is not None]
+
+    def resume(self) -> list:
+        """Finishes runs that were interrupted, returns the warnings raised while doing it."""
+        warnings = []
+        for run, renames, finished, copied in self.runs():
+            if finished:
+                continue
+            self._run = run
+            if copied:
+                # copies are made straight to their target, one cut short is smaller than its source
+                for source, target in renames:
+                    if os.path.exists(target) and os.path.exists(source) and os.path.getsize(target) != os.path.getsize(source):
+                        os.remove(target)
+                self.end()
+                warnings.append(f"Import of {len(renames)} files was interrupted, import again to copy the rest")
+                continue
+
+            for source, target in renames:
+                if os.path.exists(source) and not os.path.exists(target):
+                    os.rename(source, target)
+            self.end()
+            warnings.append(f"Finished interrupted rename of {len(renames)} files")
+        return warnings
+
+    def undo(self) -> int:
+        """Reverts the last run, returns how many files got their old name back or, for an import, how many copies were removed."""
+        # runs that only wrote tags have nothing to rename back
+        runs = [run for run in self.runs() if run[1]]
+        if not runs:
+            return 0
+
+        run, renames, _, copied = runs[-1]
+        restored = 0
+        if copied:
+            # only copies whose original is still there are removed
+            for source, target in renames:
+                if os.path.exists(target) and os.path.exists(source) and os.path.getsize(target) == os.path.getsize(source):
+                    os.remove(target)
+                    restored += 1
+            self._write([{"run": run, "event": "undone"}])
+            return restored
+
+        for source, target in reversed(renames):
+            if os.path.exists(target) and not os.path.exists(source):
+                os.rename(target, source)
+                restored += 1
+
+        # the undo is a run of its own, so undoing again redoes the renames
+        self.begin([PlanEntry(target, source.name) for source, target in renames])
+        self.end()
+        return restored
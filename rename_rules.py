@@ -0,0 +1,127 @@
+import re
+from datetime import datetime, timedelta
+
+# dates as exiftool writes them
+DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+DATE_PATTERN = re.compile(r"(\d{4}):(\d\d):(\d\d) (\d\d):(\d\d):(\d\d)", re.ASCII)
+
+# what cameras, and QuickTime files with a zero creation time, write when they don't know the date
+ZERO_DATE = "0000:00:00"
+
+
+def parseDate(text: str) -> datetime:
+    """Parses DATE_FORMAT by position, only falling back to strptime for what doesn't look like it."""
+    match = DATE_PATTERN.fullmatch(text)
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    # strptime gets the final word, so what it accepted or refused before still is
+    return datetime.strptime(text, DATE_FORMAT)
+
+
+def hasDate(metadata: dict, tag: str) -> bool:
+    """Whether metadata has tag with a date that isn't zeroed."""
+    value = metadata.get(tag)
+    return value is not None and not str(value).startswith(ZERO_DATE)
+
+
+def formatName(dt: datetime) -> str:
+    # same as dt.strftime("%Y%m%d_%H%M%S") for every year with four digits
+    return f"{dt.year:04}{dt.month:02}{dt.day:02}_{dt.hour:02}{dt.minute:02}{dt.second:02}"
+
+
+class RenameRule:
+    """Where the capture date of a kind of file comes from.
+
+    A rule applies to files whose QuickTime:Model is model (any model when None) and whose
+    File:FileTypeExtension is extension (any when None), or with software set, to files made by
+    that EXIF:Software, which are never renamed. The date is read from tag, without its time zone
+    when stripZone, shifted by the hours of the offset setting and, with subSeconds, the
+    sub-seconds after its "." are kept in the name. A lenient rule skips files with an invalid
+    date instead of failing the run.
+    """
+
+    def __init__(self, name: str, tag: str = None, model: str = None, extension: str = None, software: str = None,
+                 offset: str = None, stripZone: bool = True, subSeconds: bool = False, lenient: bool = False) -> None:
+        self.name = name
+        self.tag = tag
+        self.model = model
+        self.extension = extension
+        self.software = software
+        self.offset = offset
+        self.stripZone = stripZone
+        self.subSeconds = subSeconds
+        self.lenient = lenient
+
+    @property
+    def skip(self) -> bool:
+        return self.software is not None
+
+
+# first match wins: software, then model and extension, then model alone, then the first tag present
+RENAME_RULES = [
+    RenameRule("instagram", software="Instagram"),
+    RenameRule("dji-pocket", "QuickTime:CreateDate", model="DJI Pocket", offset="djiPocket", stripZone=False),
+    RenameRule("iphone-mov", "QuickTime:CreationDate", model="iPhone 12", extension="mov", offset="iphoneMov"),
+    RenameRule("subsec-original", "Composite:SubSecDateTimeOriginal", subSeconds=True),
+    RenameRule("date-original", "EXIF:DateTimeOriginal"),
+    RenameRule("quicktime-create", "QuickTime:CreateDate", lenient=True),
+]
+
+
+class RenameRules:
+    """RENAME_RULES compiled into lookups, counting how many files every rule named."""
+
+    def __init__(self, rules: list = RENAME_RULES, offsets: dict = {}) -> None:
+        self._software = {}
+        self._models = {}
+        self._tags = []
+        for rule in rules:
+            if rule.skip:
+                self._software.setdefault(rule.software, rule)
+            elif rule.model is not None:
+                self._models.setdefault((rule.model, rule.extension), rule)
+            else:
+                self._tags.append(rule)
+
+        self._offsets = {rule.name: timedelta(hours=offsets[rule.offset]) for rule in rules
+                         if rule.offset and offsets.get(rule.offset)}
+        self.hits = {rule.name: 0 for rule in rules}
+
+    def match(self, metadata: dict) -> RenameRule|None:
+        """The rule naming a file with this metadata, None when it has no usable date, a zeroed one included."""
+        rule = self._software.get(metadata.get("EXIF:Software"))
+        if rule is None:
+            model = metadata.get("QuickTime:Model")
+            if model is not None:
+                extension = str(metadata.get("File:FileTypeExtension", "")).lower()
+                rule = self._models.get((model, extension)) or self._models.get((model, None))
+                if rule is not None and not hasDate(metadata, rule.tag):
+                    rule = None
+            if rule is None:
+                rule = next((rule for rule in self._tags if hasDate(metadata, rule.tag)), None)
+
+        if rule is not None:
+            self.hits[rule.name] += 1
+        return rule
+
+    def name(self, rule: RenameRule, metadata: dict) -> str:
+        """The new name of a file matched by rule, raises ValueError when its date is invalid."""
+        text = metadata[rule.tag]
+        if rule.stripZone:
+            text = text.split("+")[0]
+        subSeconds = None
+        if rule.subSeconds:
+            text, subSeconds = text.split(".")
+
+        try:
+            dt = parseDate(text)
+        except ValueError:
+            raise ValueError(f"Invalid date: {text}")
+
+        offset = self._offsets.get(rule.name)
+        if offset:
+            dt = dt + offset
+        return f"{formatName(dt)}_{subSeconds}" if rule.subSeconds else formatName(dt)
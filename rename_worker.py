@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+from pathlib import Path
+
+from PySide6.QtCore import QObject, Signal, Slot
+
+from database import DatabaseManager
+from rename_engine import RenameEngine
+from renamer import Renamer
+
+# minimum time between two progress signals, in seconds
+PROGRESS_INTERVAL = 0.05
+
+
+class RenameWorker(QObject):
+    """Runs the Renamer pipeline from a QThread, reporting coalesced progress to the GUI."""
+
+    progress = Signal(int, int, str, float)  # done, total, current filename, files per second
+    message = Signal(int, str)  # logging level, text
+    planned = Signal(object)  # the RenamePlan, when previewing
+    finished = Signal()
+
+    def __init__(self, engine: RenameEngine, path: Path, djiPocketOffset: int = 0, iphoneMovOffset: int = 0,
+                 recursive: bool = False, filenames: list = None, catalog: "MediaTable" = None,
+                 dedup: bool = False, bursts: bool = False, fixDates: bool = False, preview: bool = False,
+                 renaming=None, plan: "RenamePlan" = None) -> None:
+        super().__init__()
+        # a previewed plan, applied as it was shown instead of planning again
+        self._plan = plan
+        # told every new name before it's given, so a folder watcher doesn't take it for a new file
+        self._renaming = renaming
+        # a preview only computes the plan, nothing on disk changes
+        self._preview = preview
+        self._path = path
+        self._recursive = recursive
+        self._dedup = dedup
+        self._filenames = filenames
+        self._renamer = Renamer(engine, djiPocketOffset, iphoneMovOffset,
+                                message=self._message, step=self._step, checkpoint=self._checkpoint,
+                                catalog=catalog, bursts=bursts, fixDates=fixDates)
+
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+        self._done = 0
+        self._startTime = 0
+        self._lastProgress = 0
+
+    def cancel(self):
+        self._cancelled.set()
+        self._resumed.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def _checkpoint(self) -> bool:
+        # blocks while paused, returns False once cancelled
+        self._resumed.wait()
+        return not self._cancelled.is_set()
+
+    def _message(self, text: str, level: int = logging.INFO):
+        self.message.emit(level, text)
+
+    def _step(self, filename: str):
+        self._done += 1
+        self._emitProgress(filename)
+
+    def _emitProgress(self, filename: str, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._lastProgress >= PROGRESS_INTERVAL:
+            self._lastProgress = now
+            elapsed = now - self._startTime
+            # files the scanner hasn't reached yet still count as work left
+            scanner = self._renamer.scanner
+            total = max(self._done, scanner.estimatedTotal) if scanner else self._done
+            self.progress.emit(self._done, total, filename, self._done / elapsed if elapsed else 0.0)
+
+    @Slot()
+    def run(self):
+        self._startTime = time.monotonic()
+        try:
+            journal = self._renamer.journal(self._path)
+
+            if not self._preview:
+                for warning in journal.resume():
+                    self._message(warning, logging.WARNING)
+
+                if self._dedup:
+                    self._renamer.deduplicate(self._path, journal, self._recursive, self._filenames)
+
+                if self._plan is not None:
+                    # the preview changed nothing on disk, files resume or dedup moved since are still in it
+                    self._plan.drop({filename for filename in self._plan.sources() if not filename.exists()})
+
+            plan = self._plan
+            if plan is None:
+                plan = self._renamer.plan(self._path, self._recursive, self._filenames)
+
+            if plan is None:
+                self._message("Rename cancelled, nothing was renamed.", logging.WARNING)
+            elif self._preview:
+                self._renamer.repairDates(plan, journal, dryRun=True)
+                self.planned.emit(plan)
+            else:
+                if self._plan is None:
+                    self._renamer.repairDates(plan, journal)
+                else:
+                    self._renamer.writeDates(plan, journal)
+                self._renamer.apply(plan, journal, self._cancelled.is_set, self._renaming)
+                self._message(f"Rule hits: {', '.join(f'{name} {hits}' for name, hits in self._renamer.ruleHits.items() if hits)}")
+        except Exception as error:
+            # the journal keeps what was done so far, renaming again resumes from there
+            self._message(f"Rename failed: {type(error).__name__}: {error}", logging.ERROR)
+        finally:
+            self._emitProgress("", force=True)
+            # the thread ends with the run, so does the connection it opened for the catalog
+            DatabaseManager.get().release()
+            self.finished.emit()
@@ -0,0 +1,433 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from rename_engine import RenameEngine, RENAME_BATCH_SIZE
+from media_scanner import DirectoryScanner, IncrementalScanner, FileList
+from rename_plan import RenamePlan, RenameJournal
+from media_hash import sampleHash
+from dedup import findDuplicates, markDuplicates
+from rename_rules import RenameRules, DATE_FORMAT, formatName
+from date_repair import inferDates, dateTag
+
+# files taken from the scanner before asking the engine for their metadata
+SCAN_CHUNK_SIZE = 2000
+
+
+class Renamer:
+    """The rename pipeline, scan -> metadata -> plan -> apply, free of any GUI state.
+
+    message receives log lines and their logging level, step is called with every file name looked at and checkpoint, when
+    given, is asked before each file whether to carry on. With a catalog (database.MediaTable),
+    every file scanned is recorded there once the plan is applied, without a capture date when it
+    has none, and, with bursts, its
+    pictures are grouped by perceptual hash so near identical shots can be culled together.
+    With fingerprints (database.DirectoryFingerprintTable), scans are recursive and only look at
+    the folders changed since the last one. With fixDates, files without a capture date are kept
+    for repairDates.
+    """
+
+    def __init__(self, engine: RenameEngine, djiPocketOffset: int = 0, iphoneMovOffset: int = 0,
+                 message=None, step=None, checkpoint=None, catalog: "MediaTable" = None,
+                 bursts: bool = False, fingerprints: "DirectoryFingerprintTable" = None, fixDates: bool = False,
+                 burstWindow: float = None) -> None:
+        self._engine = engine
+        self._fixDates = fixDates
+        self._undated = []
+        self._dated = []
+        self._catalog = catalog
+        self._bursts = bursts
+        # seconds between two shots of a burst, perceptual_hash.BURST_WINDOW when None
+        self._burstWindow = burstWindow
+        self._fingerprints = fingerprints
+        self._rules = RenameRules(offsets={"djiPocket": djiPocketOffset, "iphoneMov": iphoneMovOffset})
+        self._message = message or (lambda text, level=logging.INFO: None)
+        self._step = step or (lambda filename: None)
+        self._checkpoint = checkpoint or (lambda: True)
+        self.scanner = None
+
+    @staticmethod
+    def journal(path: Path) -> RenameJournal:
+        return RenameJournal(path if path.is_dir() else path.parent)
+
+    def _ignored(self, path: str):
+        self._message(f"Ignoring {path}, since it's marked to be deleted.")
+
+    def _chunks(self, excluded: set = ()):
+        chunk = []
+        for filename in self.scanner:
+            if filename in excluded:
+                continue
+            chunk.append(filename)
+            if len(chunk) >= SCAN_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def deduplicate(self, path: Path, journal: RenameJournal, recursive: bool = False, filenames: list = None,
+                    dryRun: bool = False) -> list:
+        """Marks all but one copy of identical files __to_delete__ so the rename skips them, returns the groups found."""
+        if filenames is None:
+            filenames = DirectoryScanner(path, recursive=recursive)
+
+        groups = findDuplicates(filenames)
+        for group in groups:
+            duplicates = ", ".join(filename.name for filename in group[1:])
+            self._message(f"{duplicates} same content as {group[0]}, keeping {group[0].name}")
+
+        if not dryRun:
+            for warning in markDuplicates(groups, journal):
+                self._message(warning, logging.WARNING)
+        return groups
+
+    def plan(self, path: Path, recursive: bool = False, filenames: list = None, excluded: set = ()) -> RenamePlan|None:
+        """Computes the renames for path (or just filenames), returns None when stopped by checkpoint.
+
+        Files in excluded are left out, as if they were already marked __to_delete__.
+        """
+        if filenames is not None:
+            self.scanner = FileList(filenames)
+        elif self._fingerprints is not None:
+            self.scanner = IncrementalScanner(path, self._fingerprints.subtree(path), ignored=self._ignored)
+        else:
+            self.scanner = DirectoryScanner(path, recursive=recursive, ignored=self._ignored)
+
+        plan = RenamePlan()
+        self._undated = []
+        self._dated = []
+        for chunk in self._chunks(excluded):
+            # metadata comes back from the exiftool pool in scan order
+            for filename, metadata in self._engine.metadata(chunk):
+                if not self._checkpoint():
+                    return None
+
+                self._step(filename.name)
+
+                if metadata is None:
+                    self._message(f"{filename} has no metadata", logging.WARNING)
+                    plan.skip(filename, "No metadata")
+                    if self._catalog:
+                        plan.named.append((filename, None, {}))
+                    continue
+
+                rule, new_filename, reason = self._name(filename, metadata)
+                if self._fixDates:
+                    if rule is None:
+                        # dated, or skipped, by repairDates
+                        self._undated.append((filename, metadata))
+                        continue
+                    if new_filename is not None:
+                        self._dated.append((filename, new_filename))
+
+                if new_filename is None:
+                    plan.skip(filename, reason, rule.name if rule else None)
+                    if self._catalog:
+                        plan.named.append((filename, None, metadata))
+                    continue
+
+                entry = plan.add(filename, new_filename, filename.suffix[1:].lower(), rule.name)
+                for warning in entry.warnings if entry else []:
+                    self._message(warning, logging.WARNING)
+                if self._catalog:
+                    plan.named.append((filename, new_filename, metadata))
+        self._engine.evictCache()
+        return plan
+
+    def repairDates(self, plan: RenamePlan, journal: RenameJournal, dryRun: bool = False) -> dict:
+        """Dates the files plan found without a capture date and adds them to it, returns {filename: (datetime, how)}.
+
+        The guessed date is written to the files' DateTimeOriginal (CreateDate for movies) in batches
+        and recorded in the journal, unless dryRun, which leaves the dates in plan for writeDates.
+        """
+        if not self._undated:
+            return {}
+
+        metadata = dict(self._undated)
+        dates = inferDates(list(metadata), self._dated)
+        for filename in metadata:
+            if filename not in dates:
+                plan.skip(filename, "No capture date, none could be guessed")
+                if self._catalog:
+                    plan.named.append((filename, None, metadata[filename]))
+
+        for filename, (date, how) in dates.items():
+            tag, value = dateTag(filename, metadata[filename]), date.strftime(DATE_FORMAT)
+            plan.dates.append((filename, tag, value, how))
+            self._message(f"{filename} dated {value} from its {how}")
+
+            new_filename = formatName(date)
+            entry = plan.add(filename, new_filename, filename.suffix[1:].lower(), f"inferred-{how}")
+            for warning in entry.warnings if entry else []:
+                self._message(warning, logging.WARNING)
+            if entry:
+                entry.warnings.append(f"Capture date guessed from its {how}")
+            if self._catalog:
+                plan.named.append((filename, new_filename, {**metadata[filename], tag: value}))
+        self._undated = []
+
+        failed = set() if dryRun else self.writeDates(plan, journal)
+        return {filename: date for filename, date in dates.items() if filename not in failed}
+
+    def writeDates(self, plan: RenamePlan, journal: RenameJournal) -> set:
+        """Writes the capture dates repairDates guessed for plan, returns the files that failed, which plan no longer renames."""
+        if not plan.dates:
+            return set()
+
+        failed = set(self._engine.writeTags({filename: {tag: value} for filename, tag, value, _ in plan.dates}))
+        for filename in failed:
+            self._message(f"Couldn't write a date to {filename}", logging.ERROR)
+            plan.skip(filename, "Couldn't write its guessed capture date")
+        plan.remove(failed)
+
+        changes = [change for change in plan.dates if change[0] not in failed]
+        if changes:
+            journal.recordTags(changes)
+        plan.dates = []
+        return failed
+
+    def apply(self, plan: RenamePlan, journal: RenameJournal, cancelled=None, renaming=None):
+        for warning in plan.apply(journal, cancelled, renaming):
+            self._message(warning, logging.WARNING)
+
+        if self._catalog:
+            captured = self.updateCatalog(plan, plan.named)
+            if self._bursts:
+                self._groupBursts(captured)
+
+        if isinstance(self.scanner, IncrementalScanner) and not (cancelled and cancelled()):
+            self._storeFingerprints()
+
+    def _storeFingerprints(self):
+        scanner = self.scanner
+        if self._catalog:
+            # the catalog forgets files gone from the folders that changed and everything in removed folders
+            existing = set()
+            for directory in scanner.changed:
+                try:
+                    existing.update(os.path.join(directory, name) for name in os.listdir(directory))
+                except OSError:
+                    continue
+            pruned = self._catalog.prune(scanner.changed, existing, scanner.removed)
+            if pruned:
+                self._message(f"{pruned} files gone from the catalog")
+
+        self._fingerprints.store(scanner.fingerprints(), scanner.removed)
+        self._message(f"{len(scanner.changed)} changed folders scanned, {len(scanner.removed)} removed")
+
+    def _groupBursts(self, captured: dict):
+        # Qt's image decoders are only needed here
+        from perceptual_hash import hashImages, groupNearDuplicates, PERCEPTUAL_EXTENSIONS, BURST_WINDOW
+
+        extensions = set(PERCEPTUAL_EXTENSIONS)
+        hashes = hashImages([path for path in captured if path.suffix[1:].lower() in extensions])
+        times = {path: datetime.fromisoformat(captured[path]) if captured[path] else None for path in hashes}
+        groups = groupNearDuplicates(hashes, times=times,
+                                     window=BURST_WINDOW if self._burstWindow is None else self._burstWindow)
+        for group in groups:
+            self._message(f"Burst of {len(group)}: {', '.join(path.name for path in group)}")
+        self._catalog.storeBursts(hashes, groups)
+
+    def updateCatalog(self, plan: RenamePlan, named: list) -> list:
+        """Records [(filename, new name, metadata)] of an applied plan in the catalog, returns {path recorded: captured}.
+
+        Files without a new name are recorded without a capture date.
+        """
+        targets = {entry.source: entry.target for entry in plan}
+        known = self._catalog.hashes([filename for filename, _, _ in named])
+
+        records = []
+        removed = []
+        for filename, new_filename, metadata in named:
+            path = targets.get(filename, filename)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                # the rename was skipped, the file kept its old name
+                path = filename
+                try:
+                    size = os.stat(path).st_size
+                except OSError:
+                    continue
+
+            previous = known.get(os.path.abspath(filename))
+            if path != filename:
+                removed.append(filename)
+
+            records.append({
+                "path": path,
+                # names start with %Y%m%d_%H%M%S
+                "captured": f"{new_filename[0:4]}-{new_filename[4:6]}-{new_filename[6:8]} "
+                            f"{new_filename[9:11]}:{new_filename[11:13]}:{new_filename[13:15]}" if new_filename else None,
+                "model": metadata.get("QuickTime:Model") or metadata.get("EXIF:Model"),
+                "file_type": str(metadata.get("File:FileTypeExtension", filename.suffix[1:])).lower(),
+                "size": size,
+                "sample_hash": previous[1] if previous and previous[0] == size else sampleHash(path, size),
+            })
+
+        self._catalog.store(records, removed)
+        return {record["path"]: record["captured"] for record in records}
+
+    @property
+    def catalog(self) -> "MediaTable":
+        return self._catalog
+
+    @property
+    def ruleHits(self) -> dict:
+        """How many files every rename rule named so far."""
+        return dict(self._rules.hits)
+
+    def _name(self, filename: Path, metadata: dict) -> tuple:
+        # (rule, new name, why there's no new name)
+        rule = self._rules.match(metadata)
+        if rule is None:
+            self._message(f"Incomplete metadata  (no creation date): {filename}\n{metadata}", logging.WARNING)
+            return None, None, "No capture date"
+
+        # If it's a file generated by instagram, then mark it to remove
+        if rule.skip:
+            self._message(f"Consider marking {filename} __to_delete__")
+            return rule, None, f"Made by {rule.software}, consider marking it __to_delete__"
+
+        try:
+            return rule, self._rules.name(rule, metadata), None
+        except ValueError as error:
+            if not rule.lenient:
+                raise
+            self._message(str(error), logging.WARNING)
+            return rule, None, str(error)
+
+    def nameFor(self, filename: Path, metadata: dict) -> tuple:
+        """Returns (rule, new name), the name being None when the file shouldn't be renamed."""
+        return self._name(filename, metadata)[:2]
+
+    def generate_filename(self, filename: Path, metadata: dict) -> str:
+        return self.nameFor(filename, metadata)[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renames photos and videos after their capture date.")
+    parser.add_argument("path", type=Path, help="directory (or single file) to rename")
+    parser.add_argument("--dji-pocket", type=int, default=0, metavar="HOURS", help="offset added to DJI Pocket videos")
+    parser.add_argument("--iphone-mov", type=int, default=0, metavar="HOURS", help="offset added to iPhone MOV videos")
+    parser.add_argument("--recursive", action="store_true", help="include subfolders")
+    parser.add_argument("--incremental", action="store_true",
+                        help="recursive, only looking at folders changed since the last incremental run")
+    parser.add_argument("--import-to", type=Path, metavar="LIBRARY",
+                        help="copy path (a card or staging folder) into LIBRARY/YYYY/MM under the new names instead of renaming")
+    parser.add_argument("--no-verify", action="store_true", help="don't check imported copies against their originals")
+    parser.add_argument("--dedup", action="store_true", help="mark duplicate files __to_delete__ before renaming")
+    parser.add_argument("--fix-dates", action="store_true",
+                        help="write a capture date guessed from the name, neighbours or mtime to files without one")
+    parser.add_argument("--bursts", action="store_true", help="group near identical pictures in the media catalog")
+    parser.add_argument("--burst-window", type=float, default=None, metavar="SECONDS",
+                        help="most time between two pictures of a burst, defaults to 60")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without renaming anything")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per line")
+    parser.add_argument("--workers", type=int, default=None, help="exiftool processes, defaults to the CPU count")
+    parser.add_argument("--batch-size", type=int, default=RENAME_BATCH_SIZE, help="files per exiftool call")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the metadata cache in mediarename.db")
+    parser.add_argument("--no-catalog", action="store_true", help="don't record renamed files in the media catalog")
+    parser.add_argument("--profile-sql", action="store_true",
+                        help="time every database query, print the slowest statements and flag full table scans")
+    args = parser.parse_args(argv)
+
+    if not args.path.exists():
+        parser.error(f"{args.path} does not exist")
+    if args.bursts and args.no_catalog:
+        parser.error("--bursts stores its groups in the media catalog, it can't be used with --no-catalog")
+    if args.import_to and (args.dedup or args.fix_dates or args.incremental or args.bursts):
+        parser.error("--import-to leaves the originals untouched, it can't be used with --dedup, --fix-dates, --incremental or --bursts")
+    if args.profile_sql and args.no_cache and args.no_catalog and not args.incremental:
+        parser.error("--profile-sql times the queries on mediarename.db, with --no-cache and --no-catalog none are run")
+
+    def output(record: dict, text: str, stream=sys.stdout):
+        print(json.dumps(record) if args.json else text, file=stream, flush=True)
+
+    def message(text: str, level: int = logging.INFO):
+        output({"message": text, "level": logging.getLevelName(level)}, text, sys.stderr)
+
+    cache = None
+    catalog = None
+    fingerprints = None
+    profiler = None
+    if not args.no_cache or not args.no_catalog or args.incremental:
+        # Qt SQL drivers only load with an application instance, a core one is enough
+        from PySide6.QtCore import QCoreApplication
+        from database import MetadataCacheTable, MediaTable, DirectoryFingerprintTable
+        app = QCoreApplication.instance() or QCoreApplication([])
+        cache = None if args.no_cache else MetadataCacheTable()
+        catalog = None if args.no_catalog else MediaTable()
+        fingerprints = DirectoryFingerprintTable() if args.incremental else None
+        if args.profile_sql:
+            from query_profiler import QueryProfiler
+            profiler = QueryProfiler(explain=True).install()
+
+    engine = RenameEngine(workers=args.workers, batchSize=args.batch_size, cache=cache)
+    try:
+        renamer = Renamer(engine, args.dji_pocket, args.iphone_mov, message=message, catalog=catalog,
+                          bursts=args.bursts, fingerprints=fingerprints, fixDates=args.fix_dates,
+                          burstWindow=args.burst_window)
+        if args.import_to:
+            return _importFiles(args, engine, renamer, output, message)
+
+        journal = renamer.journal(args.path)
+        if not args.dry_run:
+            for warning in journal.resume():
+                message(warning, logging.WARNING)
+
+        groups = []
+        if args.dedup:
+            groups = renamer.deduplicate(args.path, journal, recursive=args.recursive, dryRun=args.dry_run)
+            for group in groups:
+                output({"duplicates": [str(filename) for filename in group]}, f"duplicates: {' '.join(str(filename) for filename in group)}")
+
+        # a dry run doesn't mark the copies __to_delete__, they're left out as a real run would
+        duplicates = {filename: group[0] for group in groups for filename in group[1:]} if args.dry_run else {}
+        plan = renamer.plan(args.path, recursive=args.recursive, excluded=set(duplicates))
+        for filename, kept in duplicates.items():
+            plan.skip(filename, f"Same content as {kept.name}, would be marked __to_delete__")
+        if args.fix_dates:
+            renamer.repairDates(plan, journal, dryRun=args.dry_run)
+        for entry in plan:
+            output({"source": str(entry.source), "target": str(entry.target), "rule": entry.rule, "warnings": entry.warnings},
+                   f"{entry.source} -> {entry.target}")
+
+        if not args.dry_run:
+            renamer.apply(plan, journal)
+        message(f"Rule hits: {', '.join(f'{name} {hits}' for name, hits in renamer.ruleHits.items() if hits)}")
+    finally:
+        engine.terminate()
+        if profiler:
+            profiler.uninstall()
+            message(profiler.report())
+
+    return 0
+
+
+def _importFiles(args, engine: RenameEngine, renamer: Renamer, output, message) -> int:
+    # imported late, importer builds on this module
+    from importer import Importer
+
+    importer = Importer(engine, renamer, args.import_to, verify=not args.no_verify, message=message)
+    if not args.dry_run:
+        for warning in importer.journal.resume():
+            message(warning, logging.WARNING)
+
+    plan = importer.plan(args.path)
+    for entry in plan:
+        output({"source": str(entry.source), "target": str(entry.target), "rule": entry.rule, "warnings": entry.warnings},
+               f"{entry.source} -> {entry.target}")
+
+    if not args.dry_run:
+        methods = importer.apply(plan)
+        message(f"Imported {sum(methods.values())} of {len(plan)} files ({', '.join(f'{method} {count}' for method, count in methods.items())})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())